@@ -0,0 +1,193 @@
+# Copyright (C) 2022 Matthew Marting
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+import json
+import logging
+import os
+import sys
+import traceback
+
+from cache import ResultCache, pack_result, result_key
+from ufg import Direction, Pad, PadIndex, as_pad, expand_bounded, cut_arrays
+
+logger = logging.getLogger(__name__)
+
+_result_caches = {}
+
+
+def _pack_job(job):
+    points, directions, pads = job
+    return (tuple(points), tuple(directions), tuple(as_pad(pad) for pad in pads))
+
+
+def _get_result_cache(cache_path):
+    if cache_path not in _result_caches:
+        _result_caches[cache_path] = ResultCache(cache_path)
+    return _result_caches[cache_path]
+
+
+def _run_job(packed_job, cache_path=None, clearance=0, max_passes=None, timeout=None):
+    points, directions, pads = packed_job
+    if cache_path is not None:
+        result_cache = _get_result_cache(cache_path)
+        key = result_key(points, directions, pads, clearance=clearance)
+        result = result_cache.get(key)
+        if result is not None:
+            return (True, tuple(result[0]), result[1], None)
+    try:
+        pad_index = PadIndex(pads, clearance=clearance)
+        result = expand_bounded(
+            deque(points), deque(directions), pads, max_passes=max_passes, timeout=timeout, pad_index=pad_index
+        )
+        lines = cut_arrays(result.points, pads, pad_index=pad_index)
+    except Exception:
+        return (False, traceback.format_exc())
+    points, lines = pack_result(result.points, lines)
+    # Only converged results are cached, since the others depend on the budget.
+    if cache_path is not None and result.converged:
+        result_cache.put(key, points, lines)
+    return (True, points, lines, result.reason)
+
+
+def _run_chunk(packed_jobs, **kwargs):
+    return tuple(_run_job(packed_job, **kwargs) for packed_job in packed_jobs)
+
+
+def _pack_chunk(jobs, read=None):
+    # Returns the packed jobs of a chunk, and a slot for each job: `None` for a packed job, or the failed result of
+    # a job that could not be read or packed.
+    packed_jobs = []
+    slots = []
+    for job in jobs:
+        try:
+            if read is not None:
+                job = read(job)
+            packed_jobs.append(_pack_job(job))
+        except Exception:
+            slots.append((False, traceback.format_exc()))
+        else:
+            slots.append(None)
+    return tuple(packed_jobs), slots
+
+
+def run_batch(
+    jobs, max_workers=None, chunksize=1, cache_path=None, clearance=0, max_passes=None, timeout=None, read=None
+):
+    # Expands and cuts each `(points, directions, pads)` job in a process pool, and yields `(job_index, status,
+    # *optional)` in submission order: `(job_index, True, points, silkscreen, reason)` with the expanded points and
+    # the silkscreen line strings as coordinate tuples, or `(job_index, False, traceback)` if the job failed.
+    # `reason` is `None` if the expansion converged, or else why `expand_bounded` stopped within `max_passes` and
+    # `timeout`.  At most a few chunks per worker are in flight, so `jobs` may be a long or lazy iterable.  With
+    # `read`, each job is first made by calling it, e.g. `read_job` on a line, and a job that cannot be read fails
+    # on its own.  With `cache_path`, workers serve and store results through a `ResultCache` in that directory.
+    # The silkscreen keeps `clearance` from the pads.  If a worker dies, e.g. it was killed for running out of
+    # memory, the jobs in flight in its pool fail and later jobs get a new pool.
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    jobs = iter(jobs)
+    job_index = 0
+    executor = ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        chunks = deque()
+        while True:
+            while len(chunks) < 2 * max_workers:
+                packed_jobs, slots = _pack_chunk(islice(jobs, chunksize), read=read)
+                if len(slots) == 0:
+                    break
+                future = None
+                if len(packed_jobs) > 0:
+                    future = executor.submit(
+                        _run_chunk,
+                        packed_jobs,
+                        cache_path=cache_path,
+                        clearance=clearance,
+                        max_passes=max_passes,
+                        timeout=timeout,
+                    )
+                chunks.append((executor, future, slots))
+            if len(chunks) == 0:
+                break
+            chunk_executor, future, slots = chunks.popleft()
+            results = ()
+            if future is not None:
+                try:
+                    results = future.result()
+                except BrokenProcessPool:
+                    if chunk_executor is executor:
+                        logger.warning("worker pool broken, restarting it")
+                        executor = ProcessPoolExecutor(max_workers=max_workers)
+                        chunk_executor.shutdown(wait=False)
+                    results = ((False, traceback.format_exc()),) * sum(slot is None for slot in slots)
+            results = iter(results)
+            for slot in slots:
+                yield (job_index,) + (next(results) if slot is None else slot)
+                job_index += 1
+    finally:
+        executor.shutdown()
+
+
+def parse_job(job):
+    points = deque(tuple(point) for point in job["points"])
+    directions = deque(None if direction is None else Direction[direction] for direction in job["directions"])
+    pads = tuple(Pad(pad["bounds"], Direction[pad["direction"]]) for pad in job["pads"])
+    return (points, directions, pads)
+
+
+def read_job(line):
+    return parse_job(json.loads(line))
+
+
+def result_record(result):
+    job_index, status, *optional = result
+    if status:
+        points, silkscreen, reason = optional
+        record = {"index": job_index, "points": points, "silkscreen": silkscreen, "converged": reason is None}
+        if reason is not None:
+            record["reason"] = reason
+    else:
+        (error,) = optional
+        record = {"index": job_index, "error": error}
+    return record
+
+
+def write_result(result, file):
+    file.write(json.dumps(result_record(result)) + "\n")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(allow_abbrev=False)
+    parser.add_argument("-j", "--jobs", type=int, default=None)
+    parser.add_argument("--chunksize", type=int, default=1)
+    parser.add_argument("--cache", type=str, default=None)
+    parser.add_argument("--clearance", type=float, default=0)
+    parser.add_argument("--max-passes", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=None)
+    parser.add_argument("input", nargs="?", default="-")
+    args = parser.parse_args()
+
+    if args.input == "-":
+        file = sys.stdin
+    else:
+        file = open(args.input)
+    n_failures = 0
+    with file:
+        for result in run_batch(
+            (line for line in file if line.strip()),
+            max_workers=args.jobs,
+            chunksize=args.chunksize,
+            cache_path=args.cache,
+            clearance=args.clearance,
+            max_passes=args.max_passes,
+            timeout=args.timeout,
+            read=read_job,
+        ):
+            n_failures += not result[1]
+            write_result(result, sys.stdout)
+    if n_failures > 0:
+        print(f"{n_failures} job(s) failed", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,150 @@
+# Copyright (C) 2022 Matthew Marting
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from argparse import ArgumentParser
+from collections import deque
+from importlib import import_module
+import json
+import random
+from time import perf_counter
+import tracemalloc
+
+from ufg import PadIndex, Stats, expand_bounded, cut_arrays
+from fuzz import generate
+
+
+FIXTURES = ("resistor", "chip", "test3", "test4")
+
+
+def fixtures():
+    for name in FIXTURES:
+        module = import_module(name)
+        yield name, module.points, module.directions, module.pads
+
+
+def corpus(n_points_sweep, n_pads_sweep, n_seeds, max_seeds, **kwargs):
+    for n_points in n_points_sweep:
+        for n_pads in n_pads_sweep:
+            n_cases = 0
+            for seed in range(max_seeds):
+                if n_cases >= n_seeds:
+                    break
+                kwargs.update(n_points=n_points, n_pads=n_pads)
+                try:
+                    points, directions, pads = generate(**kwargs, rng=random.Random(seed))
+                except RuntimeError:
+                    continue
+                n_cases += 1
+                yield f"fuzz-{n_points}-{n_pads}-{seed}", points, directions, pads
+
+
+def run_case(points, directions, pads, repeat, max_passes=None, timeout=None):
+    times = []
+    for _ in range(repeat):
+        stats = Stats()
+        start_time = perf_counter()
+        pad_index = PadIndex(pads)
+        result = expand_bounded(
+            deque(points),
+            deque(directions),
+            pads,
+            max_passes=max_passes,
+            timeout=timeout,
+            pad_index=pad_index,
+            stats=stats,
+        )
+        cut_arrays(result.points, pads, pad_index=pad_index, stats=stats)
+        times.append(perf_counter() - start_time)
+    tracemalloc.start()
+    cut_arrays(
+        expand_bounded(deque(points), deque(directions), pads, max_passes=max_passes, timeout=timeout).points, pads
+    )
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), stats, peak_memory, result
+
+
+def run(cases, repeat, file, max_passes=None, timeout=None):
+    print(
+        f"{'case':<24} {'points':>6} {'pads':>5} {'time (s)':>10} {'expansions':>10} {'make_valid':>10} "
+        f"{'scans':>7} {'predicates':>10} {'peak (KiB)':>10} {'status':>10}"
+    )
+    for name, points, directions, pads in cases:
+        try:
+            time, stats, peak_memory, result = run_case(
+                points, directions, pads, repeat, max_passes=max_passes, timeout=timeout
+            )
+        except Exception as e:
+            print(f"{name:<24} {len(points):>6} {len(pads):>5} error: {type(e).__name__}: {e}")
+            record = {"case": name, "n_points": len(points), "n_pads": len(pads), "error": repr(e)}
+        else:
+            print(
+                f"{name:<24} {len(points):>6} {len(pads):>5} {time:>10.4f} {stats.n_expansions:>10} "
+                f"{stats.n_make_valid_passes:>10} {stats.n_scans:>7} {stats.n_predicates:>10} "
+                f"{peak_memory / 1024:>10.1f} {'converged' if result.converged else result.reason:>10}"
+            )
+            record = {
+                "case": name,
+                "n_points": len(points),
+                "n_pads": len(pads),
+                "time": time,
+                "n_expansions": stats.n_expansions,
+                "n_make_valid_passes": stats.n_make_valid_passes,
+                "n_scans": stats.n_scans,
+                "n_predicates": stats.n_predicates,
+                "times": dict(stats.times),
+                "peak_memory": peak_memory,
+                "converged": result.converged,
+                "n_iterations": result.n_iterations,
+                "n_passes": result.n_passes,
+                "reason": result.reason,
+            }
+        if file is not None:
+            file.write(json.dumps(record) + "\n")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seeds", type=int, default=5)
+    parser.add_argument("--max-seeds", type=int, default=100)
+    parser.add_argument("--n-points", type=int, nargs="+", default=(8, 16, 32))
+    parser.add_argument("--n-pads", type=int, nargs="+", default=(4, 16, 64))
+    parser.add_argument("--r-mu", type=float, default=1.5)
+    parser.add_argument("--r-sigma", type=float, default=0.5)
+    parser.add_argument("--theta-kappa", type=float, default=4.0)
+    parser.add_argument("--max-attempts", type=int, default=100)
+    parser.add_argument("--direction-weight", type=float, default=0.5)
+    parser.add_argument("--margin", type=int, default=3)
+    parser.add_argument("--pad-dx", type=int, default=4)
+    parser.add_argument("--pad-dy", type=int, default=2)
+    parser.add_argument("--no-fixtures", action="store_true")
+    parser.add_argument("--max-passes", type=int, default=2000)
+    parser.add_argument("--timeout", type=float, default=None)
+    parser.add_argument("--json", type=str, default=None)
+    args = parser.parse_args()
+
+    cases = ()
+    if not args.no_fixtures:
+        cases = tuple(fixtures())
+    cases += tuple(
+        corpus(
+            args.n_points,
+            args.n_pads,
+            args.seeds,
+            args.max_seeds,
+            r_mu=args.r_mu,
+            r_sigma=args.r_sigma,
+            theta_kappa=args.theta_kappa,
+            max_attempts=args.max_attempts,
+            direction_weight=args.direction_weight,
+            margin=args.margin,
+            pad_dx=args.pad_dx,
+            pad_dy=args.pad_dy,
+        )
+    )
+    if args.json is None:
+        run(cases, args.repeat, None, max_passes=args.max_passes, timeout=args.timeout)
+    else:
+        with open(args.json, "w") as file:
+            run(cases, args.repeat, file, max_passes=args.max_passes, timeout=args.timeout)
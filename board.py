@@ -0,0 +1,204 @@
+# Copyright (C) 2022 Matthew Marting
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from argparse import ArgumentParser
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from math import cos, radians, sin, sqrt
+import json
+import os
+import sys
+import traceback
+
+from shapely.geometry import Polygon
+
+from batch import _pack_job, parse_job, result_record
+from cache import pack_result
+from ufg import N_DIMENSIONS, Direction, Pad, PadIndex, cut_arrays, expand_bounded
+
+
+class Placement:
+    # Where a component sits on the board: mirrored about its y axis if on the back, then rotated counter-clockwise
+    # by `rotation` degrees, then moved to `at`.  Quarter turns map integer coordinates to integer coordinates
+    # exactly.
+    __slots__ = ("at", "rotation", "mirror")
+
+    def __init__(self, at=(0, 0), rotation=0, mirror=False):
+        self.at = tuple(at)
+        self.rotation = rotation
+        self.mirror = mirror
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.at}, rotation={self.rotation}, mirror={self.mirror})"
+
+    @property
+    def n_quarter_turns(self):
+        if self.rotation % 90 != 0:
+            return None
+        return int(self.rotation // 90) % 4
+
+    def transform_vector(self, vector):
+        x, y = vector
+        if self.mirror:
+            x = -x
+        if self.n_quarter_turns is None:
+            return (
+                x * cos(radians(self.rotation)) - y * sin(radians(self.rotation)),
+                x * sin(radians(self.rotation)) + y * cos(radians(self.rotation)),
+            )
+        for _ in range(self.n_quarter_turns):
+            x, y = -y, x
+        return (x, y)
+
+    def transform_point(self, point):
+        return tuple(x + at_x for x, at_x in zip(self.transform_vector(point), self.at))
+
+    def transform_points(self, points):
+        return [self.transform_point(point) for point in points]
+
+    def transform_pad(self, pad):
+        # A pad turned by other than quarter turns becomes a polygon and keeps its direction, which is only used to
+        # expand outlines in their own footprints' coordinates.
+        corners = self.transform_points(pad.exterior_coords[:-1])
+        if self.n_quarter_turns is None:
+            return Pad.from_polygon(Polygon(corners), pad.direction)
+        direction = Direction(self.transform_vector(pad.direction.value))
+        if pad.polygon is not None:
+            return Pad.from_polygon(Polygon(corners), direction)
+        return Pad(tuple(min(x) for x in zip(*corners)) + tuple(max(x) for x in zip(*corners)), direction)
+
+
+def get_bounds(points):
+    return tuple(min(x) for x in zip(*points)) + tuple(max(x) for x in zip(*points))
+
+
+_board_pad_index = None
+
+
+def _set_board_pads(pads, clearance=0):
+    global _board_pad_index
+    _board_pad_index = PadIndex(pads, clearance=clearance)
+
+
+def _run_tile(packed_components, max_passes=None, timeout=None):
+    # Expands each component against its own pads in its own coordinates, places it, and cuts it against the pads
+    # of the whole board near its expanded outline.
+    results = []
+    for component_index, (points, directions, component_pads), placement in packed_components:
+        try:
+            result = expand_bounded(
+                deque(points),
+                deque(directions),
+                component_pads,
+                max_passes=max_passes,
+                timeout=timeout,
+                pad_index=PadIndex(component_pads, clearance=_board_pad_index.clearance),
+            )
+            board_points = placement.transform_points(result.points)
+            pads = _board_pad_index.query(get_bounds(board_points))
+            lines = cut_arrays(board_points, pads, pad_index=PadIndex(pads))
+        except Exception:
+            results.append((component_index, False, traceback.format_exc()))
+            continue
+        results.append((component_index, True) + pack_result(board_points, lines) + (result.reason,))
+    return results
+
+
+def get_tiles(all_bounds, tile_size):
+    # Groups the components by the tile holding the centre of their bounds.
+    tiles = defaultdict(list)
+    for component_index, bounds in enumerate(all_bounds):
+        tiles[
+            tuple(
+                int((bounds[dimension] + bounds[N_DIMENSIONS + dimension]) / 2 // tile_size)
+                for dimension in range(N_DIMENSIONS)
+            )
+        ].append(component_index)
+    return tuple(tiles[tile] for tile in sorted(tiles))
+
+
+def run_board(components, tile_size=None, max_workers=None, clearance=0, max_passes=None, timeout=None):
+    # Generates the silkscreen of every `(points, directions, pads, placement)` component of a board.  Every outline
+    # is expanded against its own pads, but cut against the pads of all components, which are placed into one index
+    # of the board's copper that each worker builds once.  Nearby components are grouped into square tiles of
+    # `tile_size`, by default about four per worker, and each tile is one task.  Yields `(component_index, status,
+    # *optional)` as `run_batch` does, tile by tile, with the points and silkscreen in board coordinates.
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    components = tuple(
+        (_pack_job((points, directions, pads)), placement) for points, directions, pads, placement in components
+    )
+    if len(components) == 0:
+        return
+    board_pads = tuple(placement.transform_pad(pad) for (_, _, pads), placement in components for pad in pads)
+    all_bounds = tuple(get_bounds(placement.transform_points(points)) for (points, _, _), placement in components)
+    if tile_size is None:
+        board_bounds = get_bounds(
+            tuple(bounds[:N_DIMENSIONS] for bounds in all_bounds)
+            + tuple(bounds[N_DIMENSIONS:] for bounds in all_bounds)
+        )
+        board_area = (board_bounds[2] - board_bounds[0]) * (board_bounds[3] - board_bounds[1])
+        tile_size = sqrt(board_area / (4 * max_workers)) or 1
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=_set_board_pads, initargs=(board_pads, clearance)
+    ) as executor:
+        futures = deque()
+        for tile in get_tiles(all_bounds, tile_size):
+            futures.append(
+                executor.submit(
+                    _run_tile,
+                    tuple((component_index, *components[component_index]) for component_index in tile),
+                    max_passes=max_passes,
+                    timeout=timeout,
+                )
+            )
+            while len(futures) >= 2 * max_workers:
+                yield from futures.popleft().result()
+        while len(futures) > 0:
+            yield from futures.popleft().result()
+
+
+def read_component(line):
+    component = json.loads(line)
+    placement = component.get("placement", {})
+    return (
+        component.get("name"),
+        parse_job(component)
+        + (Placement(placement.get("at", (0, 0)), placement.get("rotation", 0), placement.get("mirror", False)),),
+    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(allow_abbrev=False)
+    parser.add_argument("-j", "--jobs", type=int, default=None)
+    parser.add_argument("--tile-size", type=float, default=None)
+    parser.add_argument("--clearance", type=float, default=0)
+    parser.add_argument("--max-passes", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=None)
+    parser.add_argument("input", nargs="?", default="-")
+    args = parser.parse_args()
+
+    if args.input == "-":
+        file = sys.stdin
+    else:
+        file = open(args.input)
+    with file:
+        named_components = tuple(read_component(line) for line in file if line.strip())
+    names = tuple(name for name, _ in named_components)
+    n_failures = 0
+    for result in run_board(
+        (component for _, component in named_components),
+        tile_size=args.tile_size,
+        max_workers=args.jobs,
+        clearance=args.clearance,
+        max_passes=args.max_passes,
+        timeout=args.timeout,
+    ):
+        n_failures += not result[1]
+        record = result_record(result)
+        if names[result[0]] is not None:
+            record["name"] = names[result[0]]
+        sys.stdout.write(json.dumps(record) + "\n")
+    if n_failures > 0:
+        print(f"{n_failures} component(s) failed", file=sys.stderr)
+        sys.exit(1)
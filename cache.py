@@ -0,0 +1,107 @@
+# Copyright (C) 2022 Matthew Marting
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from collections import deque
+from hashlib import sha256
+import json
+import os
+from tempfile import NamedTemporaryFile
+
+from ufg import ALGORITHM_VERSION, PadIndex, as_pad, expand_bounded, cut_arrays
+
+
+def result_key(points, directions, pads, clearance=0):
+    pads = tuple(as_pad(pad) for pad in pads)
+    key = (
+        ALGORITHM_VERSION,
+        float(clearance),
+        tuple(tuple(float(x) for x in point) for point in points),
+        tuple(None if direction is None else direction.name for direction in directions),
+        tuple(tuple(float(x) for x in pad.bounds) for pad in pads),
+        tuple(pad.direction.name for pad in pads),
+        tuple(None if pad.polygon is None else pad.polygon.wkt for pad in pads),
+    )
+    return sha256(json.dumps(key, separators=(",", ":")).encode()).hexdigest()
+
+
+def pack_result(points, lines):
+    return (
+        tuple(tuple(float(x) for x in point) for point in points),
+        tuple(tuple(tuple(float(x) for x in point) for point in line) for line in lines),
+    )
+
+
+class ResultCache:
+    # Results are stored as one JSON file per key.  Reading an entry touches its modification time, and when the
+    # cache grows past `max_size` bytes the least recently used entries are removed.
+    def __init__(self, path, max_size=256 * 1024 * 1024):
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(self.path, exist_ok=True)
+        self.size = sum(os.path.getsize(entry_path) for entry_path in self._entry_paths())
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], f"{key}.json")
+
+    def _entry_paths(self):
+        for directory_path, _, file_names in os.walk(self.path):
+            for file_name in file_names:
+                if file_name.endswith(".json"):
+                    yield os.path.join(directory_path, file_name)
+
+    def get(self, key):
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path) as file:
+                points, lines = json.load(file)
+            os.utime(entry_path)
+        except (FileNotFoundError, ValueError):
+            return None
+        return (deque(tuple(point) for point in points), tuple(tuple(map(tuple, line)) for line in lines))
+
+    def put(self, key, points, lines):
+        entry_path = self._entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        with NamedTemporaryFile("w", dir=os.path.dirname(entry_path), suffix=".tmp", delete=False) as file:
+            json.dump(pack_result(points, lines), file, separators=(",", ":"))
+        if os.path.exists(entry_path):
+            self.size -= os.path.getsize(entry_path)
+        os.replace(file.name, entry_path)
+        self.size += os.path.getsize(entry_path)
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        entries = []
+        for entry_path in self._entry_paths():
+            try:
+                stat = os.stat(entry_path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in entries:
+            if self.size <= self.max_size:
+                break
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+    def silkscreen(self, points, directions, pads, clearance=0, max_passes=None, timeout=None):
+        # Only converged results are stored, since the others depend on `max_passes` and `timeout`.
+        key = result_key(points, directions, pads, clearance=clearance)
+        result = self.get(key)
+        if result is not None:
+            return result
+        pad_index = PadIndex(pads, clearance=clearance)
+        result = expand_bounded(
+            deque(points), deque(directions), pads, max_passes=max_passes, timeout=timeout, pad_index=pad_index
+        )
+        lines = cut_arrays(result.points, pads, pad_index=pad_index)
+        points, lines = pack_result(result.points, lines)
+        if result.converged:
+            self.put(key, points, lines)
+        return (deque(points), lines)
@@ -0,0 +1,123 @@
+# Copyright (C) 2022 Matthew Marting
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from argparse import ArgumentParser
+import json
+import os
+
+import numpy as np
+
+from ufg import N_DIMENSIONS
+
+CHUNK_SIZE = 1 << 12
+
+
+def concatenate_lines(lines):
+    # Returns the coordinates of all the line strings in one array and the number of points in each.
+    lines = tuple(np.asarray(line, dtype=float).reshape(-1, N_DIMENSIONS) for line in lines)
+    lengths = np.array(tuple(len(line) for line in lines), dtype=int)
+    if len(lines) == 0:
+        return np.empty((0, N_DIMENSIONS)), lengths
+    return np.concatenate(lines), lengths
+
+
+def segment_start_indices(lengths):
+    # Returns the index of the first point of each segment of the concatenated line strings.
+    is_segment_start = np.ones(max(np.sum(lengths) - 1, 0), dtype=bool)
+    is_segment_start[np.cumsum(lengths)[:-1] - 1] = False
+    return np.flatnonzero(is_segment_start)
+
+
+def format_mm(x, units_per_mm=1):
+    # Like `kicad.to_mm`, for a whole array at once.  Coordinates repeat a lot, so each distinct value is only
+    # formatted once.  Adding zero turns -0 into 0.
+    values, inverse = np.unique(np.asarray(x, dtype=float) / units_per_mm + 0.0, return_inverse=True)
+    strings = np.array(tuple(f"{value:.6f}".rstrip("0").rstrip(".") for value in values.tolist()), dtype=object)
+    return strings[inverse.reshape(np.shape(x))]
+
+
+def write_rows(file, template, columns):
+    # Writes `template % row` for the rows of the columns, a chunk at a time, so that each write is large.
+    for start_index in range(0, len(columns[0]), CHUNK_SIZE):
+        rows = zip(*(column[start_index:][:CHUNK_SIZE].tolist() for column in columns))
+        file.write("".join(template % row for row in rows))
+
+
+def write_fp_lines(file, lines, legacy=False, layer="F.SilkS", width=0.12, units_per_mm=1):
+    # KiCad's y axis points down, and ufg's points up.
+    coords, lengths = concatenate_lines(lines)
+    x = format_mm(coords[:, 0], units_per_mm)
+    y = format_mm(-coords[:, 1], units_per_mm)
+    start_indices = segment_start_indices(lengths)
+    columns = (x[start_indices], y[start_indices], x[start_indices + 1], y[start_indices + 1])
+    if legacy:
+        template = f"  (fp_line (start %s %s) (end %s %s) (layer {layer}) (width {width}))\n"
+    else:
+        template = (
+            f"  (fp_line (start %s %s) (end %s %s)\n"
+            f'    (stroke (width {width}) (type solid)) (layer "{layer}"))\n'
+        )
+    write_rows(file, template, columns)
+
+
+def write_svg(file, lines, width=0.12, units_per_mm=1):
+    # Writes one path of subpaths, in millimetres, with SVG's y axis pointing down.
+    coords, lengths = concatenate_lines(lines)
+    coords = coords / units_per_mm * (1, -1)
+    if len(coords) > 0:
+        bounds = np.concatenate((coords.min(axis=0), coords.max(axis=0))) + (-width, -width, +width, +width)
+    else:
+        bounds = np.zeros(2 * N_DIMENSIONS)
+    x, y = format_mm(bounds[:N_DIMENSIONS])
+    view_width, view_height = format_mm(bounds[N_DIMENSIONS:] - bounds[:N_DIMENSIONS])
+    file.write(
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{view_width}mm" height="{view_height}mm" '
+        f'viewBox="{x} {y} {view_width} {view_height}">\n'
+    )
+    file.write(f'<path fill="none" stroke="black" stroke-width="{width}" stroke-linecap="round" d="')
+    commands = np.full(len(coords), "L")
+    commands[np.cumsum(lengths)[:-1]] = "M"
+    if len(coords) > 0:
+        commands[0] = "M"
+    write_rows(file, "%s%s %s ", (commands, format_mm(coords[:, 0]), format_mm(coords[:, 1])))
+    file.write('"/>\n</svg>\n')
+
+
+def write_gerber(file, lines, width=0.12, units_per_mm=1):
+    # Writes RS-274X draws with a round aperture, in millimetres with six decimal places.
+    coords, lengths = concatenate_lines(lines)
+    coords = np.rint(coords / units_per_mm * 1000000).astype(np.int64)
+    codes = np.full(len(coords), 1)
+    codes[np.cumsum(lengths)[:-1]] = 2
+    if len(coords) > 0:
+        codes[0] = 2
+    file.write("G04 silkscreen*\n%FSLAX46Y46*%\n%MOMM*%\n%LPD*%\n")
+    file.write(f"%ADD10C,{format_mm(width)}*%\nD10*\nG01*\n")
+    write_rows(file, "X%dY%dD%02d*\n", (coords[:, 0], coords[:, 1], codes))
+    file.write("M02*\n")
+
+
+WRITERS = {"kicad": (write_fp_lines, ".kicad_mod"), "svg": (write_svg, ".svg"), "gerber": (write_gerber, ".gbr")}
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--format", type=str, choices=tuple(WRITERS), default="svg")
+    parser.add_argument("--width", type=float, default=0.12)
+    parser.add_argument("--units-per-mm", type=float, default=1)
+    parser.add_argument("input")
+    parser.add_argument("output")
+    args = parser.parse_args()
+
+    # Writes the silkscreen of each result of batch.py to its own file.
+    write, extension = WRITERS[args.format]
+    os.makedirs(args.output, exist_ok=True)
+    with open(args.input) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "silkscreen" not in record:
+                continue
+            with open(os.path.join(args.output, f"{record['index']}{extension}"), "w", buffering=1 << 16) as file_:
+                write(file_, record["silkscreen"], width=args.width, units_per_mm=args.units_per_mm)
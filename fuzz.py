@@ -2,20 +2,36 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 from argparse import ArgumentParser
-from collections import deque
-from itertools import count
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import count, islice
+import json
 import logging
-from math import pi, cos, sin, atan2
-from random import vonmisesvariate, lognormvariate, choices, randint
+from math import pi, cos, exp, sin, atan2
+import os
+import random
+import sys
+from time import perf_counter
 
 import numpy as np
 
-from shapely.geometry import LineString, Polygon
-
-import matplotlib.pyplot as plt
+from shapely.geometry import Polygon
 
 import ufg
-from ufg import linewise, Direction, plot
+from ufg import (
+    N_DIMENSIONS,
+    linewise,
+    bounds_intersect,
+    line_bounds,
+    lines_intersect,
+    orientation,
+    Direction,
+    Pad,
+    Trace,
+    cut_arrays,
+    expand_bounded,
+    plot,
+)
 
 
 def calc(r, theta):
@@ -25,47 +41,189 @@ def calc(r, theta):
     return dx, dy, theta
 
 
+def orientation_array(points1, points2, points3):
+    # `orientation` for arrays of points.
+    return np.sign(
+        (points2[..., 0] - points1[..., 0]) * (points3[..., 1] - points1[..., 1])
+        - (points2[..., 1] - points1[..., 1]) * (points3[..., 0] - points1[..., 0])
+    )
+
+
+def lines_intersect_array(lines, all_line_bounds, other_line):
+    # `lines_intersect` between each of `lines`, whose bounds are `all_line_bounds`, and `other_line`.
+    other_line = np.array(other_line)
+    other_line_bounds = np.array(line_bounds(other_line))
+    orientations = (
+        orientation_array(lines[:, 0], lines[:, 1], other_line[0]),
+        orientation_array(lines[:, 0], lines[:, 1], other_line[1]),
+        orientation_array(other_line[0], other_line[1], lines[:, 0]),
+        orientation_array(other_line[0], other_line[1], lines[:, 1]),
+    )
+    intersect = (orientations[0] != orientations[1]) & (orientations[2] != orientations[3])
+    for orientation_index, points in enumerate((other_line[0], other_line[1])):
+        intersect |= (orientations[orientation_index] == 0) & np.all(
+            (all_line_bounds[:, :N_DIMENSIONS] <= points) & (points <= all_line_bounds[:, N_DIMENSIONS:]), axis=1
+        )
+    for orientation_index, points in enumerate((lines[:, 0], lines[:, 1]), 2):
+        intersect |= (orientations[orientation_index] == 0) & np.all(
+            (other_line_bounds[:N_DIMENSIONS] <= points) & (points <= other_line_bounds[N_DIMENSIONS:]), axis=1
+        )
+    return intersect
+
+
+class LineIndex:
+    # A uniform grid of the lines placed so far, so a short new line is only tested against the lines near it.
+    # Lines are added to the cells of their bounds and queried through the cells they pass through.  The lines
+    # are also kept in arrays, to test a long line, such as the closing one, against all of them at once.
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.lines = []
+        self.cells = defaultdict(list)
+        self.line_array = np.empty((16, 2, N_DIMENSIONS), dtype=int)
+        self.line_bounds_array = np.empty((16, 2 * N_DIMENSIONS), dtype=int)
+
+    def add(self, line):
+        start_x, start_y, stop_x, stop_y = (x // self.cell_size for x in line_bounds(line))
+        for x in range(start_x, stop_x + 1):
+            for y in range(start_y, stop_y + 1):
+                self.cells[x, y].append(len(self.lines))
+        if len(self.lines) == len(self.line_array):
+            self.line_array = np.concatenate((self.line_array, np.empty_like(self.line_array)))
+            self.line_bounds_array = np.concatenate((self.line_bounds_array, np.empty_like(self.line_bounds_array)))
+        self.line_array[len(self.lines)] = line
+        self.line_bounds_array[len(self.lines)] = line_bounds(line)
+        self.lines.append(line)
+
+    def intersecting(self, line):
+        # The indices of the lines that intersect `line`, found with arrays rather than through the grid.
+        bounds = line_bounds(line)
+        all_line_bounds = self.line_bounds_array[:len(self.lines)]
+        line_indices = np.flatnonzero(
+            np.all(all_line_bounds[:, :N_DIMENSIONS] <= bounds[N_DIMENSIONS:], axis=1)
+            & np.all(np.array(bounds[:N_DIMENSIONS]) <= all_line_bounds[:, N_DIMENSIONS:], axis=1)
+        )
+        return line_indices[
+            lines_intersect_array(self.line_array[line_indices], all_line_bounds[line_indices], line)
+        ]
+
+    def _line_cells(self, line):
+        (x1, y1), (x2, y2) = sorted(line)
+        for x in range(x1 // self.cell_size, x2 // self.cell_size + 1):
+            if x1 == x2:
+                ys = (y1 // self.cell_size, y2 // self.cell_size)
+            else:
+                # The rows of the line's ends within the column, in integers, so that no cell is missed.
+                ys = tuple(
+                    (y1 * (x2 - x1) + (edge_x - x1) * (y2 - y1)) // ((x2 - x1) * self.cell_size)
+                    for edge_x in (max(x1, x * self.cell_size), min(x2, (x + 1) * self.cell_size))
+                )
+            for y in range(min(ys), max(ys) + 1):
+                yield x, y
+
+    def query(self, line):
+        bounds = line_bounds(line)
+        line_indices = set()
+        for cell in self._line_cells(line):
+            line_indices.update(self.cells.get(cell, ()))
+        return sorted(
+            line_index
+            for line_index in line_indices
+            if bounds_intersect(bounds, line_bounds(self.lines[line_index]))
+        )
+
+
+def overlaps_back(point, common_point, other_point):
+    # Whether the line from `common_point` to `other_point` runs back over the line from `point` to it.
+    if orientation(point, common_point, other_point) != 0:
+        return False
+    return (
+        sum(
+            (common_point[dimension] - point[dimension]) * (other_point[dimension] - common_point[dimension])
+            for dimension in range(N_DIMENSIONS)
+        )
+        < 0
+    )
+
+
+def is_simple_extension(points, line_index, next_point):
+    # Whether `points` followed by `next_point` is still simple, as by `LineString.is_simple`, given that `points`
+    # is and that `line_index` holds its lines.
+    line = (points[-1], next_point)
+    for other_line_index in line_index.query(line):
+        other_line = line_index.lines[other_line_index]
+        if other_line_index == len(points) - 2:
+            if overlaps_back(other_line[0], points[-1], next_point):
+                return False
+        elif other_line_index == 0 and next_point == points[0]:
+            # The line string closes, which is simple as long as it only meets the first line at the first point.
+            if overlaps_back(points[1], points[0], points[-1]):
+                return False
+        elif lines_intersect(other_line, line):
+            return False
+    return True
+
+
+def is_valid_polygon(points, line_index):
+    # Whether the simple line string `points`, closed, is a valid polygon, as by `Polygon.is_valid`.
+    if len(points) < 4 or points[-1] == points[0]:
+        return Polygon(points).is_valid
+    line = (points[-1], points[0])
+    for other_line_index in line_index.intersecting(line):
+        if other_line_index == 0:
+            if overlaps_back(points[1], points[0], points[-1]):
+                return False
+        if other_line_index == len(points) - 2:
+            if overlaps_back(points[-2], points[-1], points[0]):
+                return False
+        if 0 < other_line_index < len(points) - 2:
+            return False
+    return True
+
+
 def main(points, directions, pads, debug=False):
+    import matplotlib.pyplot as plt
+
     if debug:
+        logging.basicConfig()
         logging.getLogger("ufg").setLevel(logging.DEBUG)
     plot(points, directions, pads, debug=debug)
     plt.show()
 
 
-if __name__ == "__main__":
-    parser = ArgumentParser(allow_abbrev=False)
-    parser.add_argument("-v", "--verbose", action="store_true")
-    parser.add_argument("n_points", type=int)
-    parser.add_argument("r_mu", type=float)
-    parser.add_argument("r_sigma", type=float)
-    parser.add_argument("theta_kappa", type=float)
-    parser.add_argument("max_attempts", type=int)
-    parser.add_argument("direction_weight", type=float)
-    parser.add_argument("n_pads", type=int)
-    parser.add_argument("margin", type=int)
-    parser.add_argument("pad_dx", type=int)
-    parser.add_argument("pad_dy", type=int)
-    args = parser.parse_args()
-
+def generate(
+    n_points,
+    r_mu,
+    r_sigma,
+    theta_kappa,
+    max_attempts,
+    direction_weight,
+    n_pads,
+    margin,
+    pad_dx,
+    pad_dy,
+    rng=random,
+):
     points = deque(((0, 0),))
-    first = True
+    line_index = LineIndex(max(round(exp(r_mu)), 1))
+    theta = None
     for point_index in count(1):
-        if point_index >= args.n_points and Polygon(points).is_valid:
+        if point_index >= n_points and is_valid_polygon(points, line_index):
             break
-        for attempt_index in range(args.max_attempts):
-            r = lognormvariate(args.r_mu, args.r_sigma)
-            if first:
-                next_theta = vonmisesvariate(0, 0)
+        for attempt_index in range(max_attempts):
+            r = rng.lognormvariate(r_mu, r_sigma)
+            if theta is None:
+                next_theta = rng.vonmisesvariate(0, 0)
             else:
-                next_theta = vonmisesvariate((theta + 2 * pi / args.n_points) % (2 * pi), args.theta_kappa)
+                next_theta = rng.vonmisesvariate((theta + 2 * pi / n_points) % (2 * pi), theta_kappa)
             dx, dy, next_theta = calc(r, next_theta)
             if dx == 0 and dy == 0:
                 continue
-            next_point = tuple(np.array(points[-1]) + np.array((dx, dy)))
-            if LineString(tuple(points) + (next_point,)).is_simple:
+            next_point = (points[-1][0] + dx, points[-1][1] + dy)
+            if is_simple_extension(points, line_index, next_point):
                 break
         else:
             raise RuntimeError(f"giving up after {attempt_index + 1} attempt(s)")
+        line_index.add((points[-1], next_point))
         points.append(next_point)
         theta = next_theta
     body = Polygon(points)
@@ -73,37 +231,261 @@ if __name__ == "__main__":
     directions = deque()
     for line_index, line in linewise(points):
         np_line = np.array(line[1]) - np.array(line[0])
+        if not np_line.any():
+            raise RuntimeError(f"line {line_index} has zero length")
         weights = tuple(
             max((np_line / np.linalg.norm(np_line)).dot(np.array(direction.value)), 0) for direction in Direction
         )
         directions.append(
-            choices(
+            rng.choices(
                 tuple(Direction) + (None,),
-                tuple(args.direction_weight * np.array(weights) / sum(weights)) + (1 - args.direction_weight,),
+                tuple(direction_weight * np.array(weights) / sum(weights)) + (1 - direction_weight,),
             )[0]
         )
 
     pads = deque()
-    for pad_index in range(args.n_pads):
-        x = randint(body.bounds[0] - args.margin, body.bounds[2] + args.margin)
-        y = randint(body.bounds[1] - args.margin, body.bounds[3] + args.margin)
-        direction = choices(tuple(Direction))[0]
+    for pad_index in range(n_pads):
+        # The points are integers, so the bounds are whole numbers, but Shapely returns them as floats.
+        x = rng.randint(int(body.bounds[0]) - margin, int(body.bounds[2]) + margin)
+        y = rng.randint(int(body.bounds[1]) - margin, int(body.bounds[3]) + margin)
+        direction = rng.choices(tuple(Direction))[0]
         if direction in (Direction.EAST, Direction.WEST):
-            dx = args.pad_dx
-            dy = args.pad_dy
+            dx = pad_dx
+            dy = pad_dy
         else:
-            dx = args.pad_dy
-            dy = args.pad_dx
-        pad = Polygon(
-            np.array((x, y))
-            + np.array(((-dx / 2, -dy / 2), (+dx / 2, -dy / 2), (+dx / 2, +dy / 2), (-dx / 2, +dy / 2)))
-        )
-        pad.direction = direction
-        pads.append(pad)
+            dx = pad_dy
+            dy = pad_dx
+        pads.append(Pad((x - dx / 2, y - dy / 2, x + dx / 2, y + dy / 2), direction))
     pads = tuple(pads)
+    return points, directions, pads
+
+
+def check(points, directions, pads, max_passes=None, timeout=None):
+    # Returns why the case fails, or `None` if it passes.
+    try:
+        result = expand_bounded(deque(points), deque(directions), pads, max_passes=max_passes, timeout=timeout)
+        cut_arrays(result.points, pads)
+    except Exception as e:
+        return f"exception: {type(e).__name__}"
+    if not result.converged:
+        return result.reason
+    body = Polygon(result.points)
+    if not body.is_valid:
+        return "invalid"
+    if not body.covers(Polygon(points)):
+        return "uncovering"
+    return None
+
+
+def minimize(points, directions, pads, failure, **kwargs):
+    # Greedily drops pads and then points for as long as the case still fails the same way.
+    points = list(points)
+    directions = list(directions)
+    pads = list(pads)
+    progress = True
+    while progress:
+        progress = False
+        for pad_index in reversed(range(len(pads))):
+            new_pads = pads[:pad_index] + pads[pad_index + 1:]
+            if check(points, directions, new_pads, **kwargs) == failure:
+                pads = new_pads
+                progress = True
+        for point_index in reversed(range(len(points))):
+            if len(points) <= 3:
+                break
+            # The lines into and out of the point become one line, which keeps the first line's direction.
+            new_points = points[:point_index] + points[point_index + 1:]
+            new_directions = directions[:point_index] + directions[point_index + 1:]
+            if not Polygon(new_points).is_valid:
+                continue
+            if check(new_points, new_directions, pads, **kwargs) == failure:
+                points = new_points
+                directions = new_directions
+                progress = True
+    return deque(points), deque(directions), tuple(pads)
+
+
+def case_record(points, directions, pads):
+    # The job format of `batch.read_job`.
+    return {
+        "points": [[int(x) if float(x).is_integer() else float(x) for x in point] for point in points],
+        "directions": [None if direction is None else direction.name for direction in directions],
+        "pads": [{"bounds": [float(x) for x in pad.bounds], "direction": pad.direction.name} for pad in pads],
+    }
+
+
+def _fuzz_chunk(seeds, generator_kwargs, max_passes=None, timeout=None, minimize_failures=True):
+    n_skipped = 0
+    failures = []
+    for seed in seeds:
+        try:
+            case = generate(**generator_kwargs, rng=random.Random(seed))
+        except RuntimeError:
+            n_skipped += 1
+            continue
+        failure = check(*case, max_passes=max_passes, timeout=timeout)
+        if failure is None:
+            continue
+        record = {"seed": seed, "failure": failure, "case": case_record(*case)}
+        if minimize_failures:
+            record["minimized"] = case_record(*minimize(*case, failure, max_passes=max_passes, timeout=timeout))
+        failures.append(record)
+    return len(seeds), n_skipped, failures
+
+
+def fuzz(
+    generator_kwargs,
+    seeds,
+    max_workers=None,
+    chunksize=64,
+    max_passes=None,
+    timeout=None,
+    minimize_failures=True,
+    report_interval=10.0,
+    file=sys.stderr,
+):
+    # Checks the cases generated from each seed in `seeds` in a process pool, and yields a record for each failing
+    # case: its seed, why it failed (as by `check`), the case in the job format of `batch.read_job`, and, if
+    # `minimize_failures`, the case minimized by `minimize`.  Every `report_interval` seconds and at the end, the
+    # numbers of cases and failures and the throughput are written to `file`.
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    seeds = iter(seeds)
+    n_cases = 0
+    n_skipped = 0
+    n_failures = 0
+    start_time = perf_counter()
+    report_time = start_time
+
+    def report():
+        elapsed_time = perf_counter() - start_time
+        print(
+            f"{n_cases} case(s), {n_skipped} skipped, {n_failures} failure(s), "
+            f"{n_cases / elapsed_time if elapsed_time > 0 else 0:.1f} case(s)/s",
+            file=file,
+        )
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = deque()
+        while True:
+            while len(futures) < 2 * max_workers:
+                chunk = tuple(islice(seeds, chunksize))
+                if len(chunk) == 0:
+                    break
+                futures.append(
+                    executor.submit(
+                        _fuzz_chunk,
+                        chunk,
+                        generator_kwargs,
+                        max_passes=max_passes,
+                        timeout=timeout,
+                        minimize_failures=minimize_failures,
+                    )
+                )
+            if len(futures) == 0:
+                break
+            chunk_n_cases, chunk_n_skipped, failures = futures.popleft().result()
+            n_cases += chunk_n_cases
+            n_skipped += chunk_n_skipped
+            n_failures += len(failures)
+            yield from failures
+            if perf_counter() - report_time >= report_interval:
+                report()
+                report_time = perf_counter()
+    report()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(allow_abbrev=False)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--headless", action="store_true")
+    parser.add_argument("--cases", type=int, default=None)
+    parser.add_argument("-j", "--jobs", type=int, default=None)
+    parser.add_argument("--chunksize", type=int, default=64)
+    parser.add_argument("--max-passes", type=int, default=2000)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--no-minimize", action="store_true")
+    parser.add_argument("--report-interval", type=float, default=10.0)
+    parser.add_argument("--output", type=str, default="-")
+    parser.add_argument("--trace", type=str, default=None)
+    parser.add_argument("n_points", type=int)
+    parser.add_argument("r_mu", type=float)
+    parser.add_argument("r_sigma", type=float)
+    parser.add_argument("theta_kappa", type=float)
+    parser.add_argument("max_attempts", type=int)
+    parser.add_argument("direction_weight", type=float)
+    parser.add_argument("n_pads", type=int)
+    parser.add_argument("margin", type=int)
+    parser.add_argument("pad_dx", type=int)
+    parser.add_argument("pad_dy", type=int)
+    args = parser.parse_args()
+
+    if args.headless:
+        generator_kwargs = {
+            "n_points": args.n_points,
+            "r_mu": args.r_mu,
+            "r_sigma": args.r_sigma,
+            "theta_kappa": args.theta_kappa,
+            "max_attempts": args.max_attempts,
+            "direction_weight": args.direction_weight,
+            "n_pads": args.n_pads,
+            "margin": args.margin,
+            "pad_dx": args.pad_dx,
+            "pad_dy": args.pad_dy,
+        }
+        start_seed = 0 if args.seed is None else args.seed
+        if args.cases is None:
+            seeds = count(start_seed)
+        else:
+            seeds = range(start_seed, start_seed + args.cases)
+        if args.output == "-":
+            file = sys.stdout
+        else:
+            file = open(args.output, "w")
+        n_failures = 0
+        with file:
+            for record in fuzz(
+                generator_kwargs,
+                seeds,
+                max_workers=args.jobs,
+                chunksize=args.chunksize,
+                max_passes=args.max_passes,
+                timeout=args.timeout,
+                minimize_failures=not args.no_minimize,
+                report_interval=args.report_interval,
+            ):
+                n_failures += 1
+                file.write(json.dumps(record) + "\n")
+                file.flush()
+        sys.exit(1 if n_failures > 0 else 0)
+
+    points, directions, pads = generate(
+        args.n_points,
+        args.r_mu,
+        args.r_sigma,
+        args.theta_kappa,
+        args.max_attempts,
+        args.direction_weight,
+        args.n_pads,
+        args.margin,
+        args.pad_dx,
+        args.pad_dy,
+        rng=random.Random(args.seed),
+    )
 
     print(points)
     print(directions)
     print(tuple((pad.bounds, pad.direction) for pad in pads))
 
+    # Large cases are traced into a `.npz` file to replay with render.py, instead of being plotted.
+    if args.trace is not None:
+        trace = Trace(pads)
+        result = expand_bounded(
+            deque(points), deque(directions), pads, max_passes=args.max_passes, timeout=args.timeout, trace=trace
+        )
+        print(result)
+        trace.save(args.trace)
+        sys.exit()
+
     main(points, directions, pads, debug=args.verbose)
@@ -0,0 +1,296 @@
+# Copyright (C) 2022 Matthew Marting
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from argparse import ArgumentParser
+from collections import deque
+from math import cos, sin, radians
+import os
+import re
+import sys
+
+from shapely.geometry import Polygon
+
+from export import write_fp_lines
+from ufg import N_DIMENSIONS, Direction, Pad, PadIndex, expand_bounded, cut_arrays, linewise
+
+
+NM_PER_MM = 1000000
+
+_TOKEN = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+_ESCAPE = re.compile(r"\\(.)")
+
+
+def tokenize(file, chunk_size=1 << 16):
+    # Yields `(kind, value, offset)`, where `kind` is "(", ")" or "atom" and `offset` is the token's character
+    # offset.
+    # The file is read `chunk_size` characters at a time; a token that may continue past the end of the buffer is
+    # held back until the next chunk arrives.
+    buffer = ""
+    buffer_offset = 0
+    eof = False
+    while not eof:
+        chunk = file.read(chunk_size)
+        eof = len(chunk) == 0
+        buffer += chunk
+        position = 0
+        while True:
+            match = _TOKEN.match(buffer, position)
+            if match is None:
+                break
+            if not eof and match.end() == len(buffer) and match.group(4) is not None:
+                break
+            offset = buffer_offset + match.start(match.lastindex)
+            if match.group(1) is not None:
+                yield ("(", "(", offset)
+            elif match.group(2) is not None:
+                yield (")", ")", offset)
+            elif match.group(3) is not None:
+                yield ("atom", _ESCAPE.sub(r"\1", match.group(3)), offset)
+            else:
+                yield ("atom", match.group(4), offset)
+            position = match.end()
+        buffer_offset += position
+        buffer = buffer[position:]
+    if buffer.strip():
+        raise ValueError(f"unexpected {buffer.strip()[:16]!r} at offset {buffer_offset}")
+
+
+def parse(tokens):
+    # Returns the first top-level expression and the offset of its closing parenthesis.
+    stack = [[]]
+    for kind, value, offset in tokens:
+        if kind == "(":
+            stack.append([])
+        elif kind == ")":
+            if len(stack) == 1:
+                raise ValueError(f"unbalanced ')' at offset {offset}")
+            node = stack.pop()
+            stack[-1].append(node)
+            if len(stack) == 1:
+                return node, offset
+        else:
+            stack[-1].append(value)
+    raise ValueError("unexpected end of file")
+
+
+def children(node, name):
+    for child in node[1:]:
+        if isinstance(child, list) and len(child) > 0 and child[0] == name:
+            yield child
+
+
+def child(node, name):
+    for child_ in children(node, name):
+        return child_
+    return None
+
+
+def to_nm(x):
+    return round(float(x) * NM_PER_MM)
+
+
+def to_mm(x):
+    return f"{x / NM_PER_MM:.6f}".rstrip("0").rstrip(".")
+
+
+def read_point(node):
+    # KiCad's y axis points down, and ufg's points up.
+    return (to_nm(node[1]), -to_nm(node[2]))
+
+
+def get_layer(node):
+    layer = child(node, "layer")
+    if layer is None:
+        return None
+    return layer[1]
+
+
+def get_outline_lines(footprint, layer):
+    for item in footprint[1:]:
+        if not isinstance(item, list) or len(item) == 0 or get_layer(item) != layer:
+            continue
+        if item[0] == "fp_line":
+            yield (read_point(child(item, "start")), read_point(child(item, "end")))
+        elif item[0] == "fp_rect":
+            (x1, y1), (x2, y2) = read_point(child(item, "start")), read_point(child(item, "end"))
+            yield from (line for _, line in linewise(((x1, y1), (x2, y1), (x2, y2), (x1, y2))))
+        elif item[0] == "fp_poly":
+            points = tuple(read_point(xy) for xy in children(child(item, "pts"), "xy"))
+            yield from (line for _, line in linewise(points))
+
+
+def chain_lines(lines):
+    lines = list(lines)
+    if len(lines) == 0:
+        raise ValueError("no outline")
+    points = list(lines.pop())
+    while len(lines) > 0:
+        for line_index, line in enumerate(lines):
+            if points[-1] in line:
+                del lines[line_index]
+                points.append(line[1] if line[0] == points[-1] else line[0])
+                break
+        else:
+            raise ValueError(f"outline is not connected at {points[-1]}")
+    if points[-1] != points[0]:
+        raise ValueError("outline is not closed")
+    points.pop()
+    if len(points) < 3:
+        raise ValueError("outline has fewer than three points")
+    return points
+
+
+def get_area(points):
+    return sum(point1[0] * point2[1] - point2[0] * point1[1] for _, (point1, point2) in linewise(points)) / 2
+
+
+def get_line_direction(line):
+    delta = tuple(x2 - x1 for x1, x2 in zip(*line))
+    if (delta[0] == 0) == (delta[1] == 0):
+        return None
+    return Direction(tuple(int(x > 0) - int(x < 0) for x in delta))
+
+
+def read_pad(node, center):
+    at = child(node, "at")
+    size = child(node, "size")
+    x, y = to_nm(at[1]), -to_nm(at[2])
+    width, height = to_nm(size[1]), to_nm(size[2] if len(size) > 2 else size[1])
+    angle = float(at[3]) if len(at) > 3 else 0.0
+    corners = tuple(
+        (dx * width / 2, dy * height / 2) for dx, dy in ((-1, -1), (+1, -1), (+1, +1), (-1, +1))
+    )
+    corners = tuple(
+        (
+            round(x + dx * cos(radians(angle)) - dy * sin(radians(angle))),
+            round(y + dx * sin(radians(angle)) + dy * cos(radians(angle))),
+        )
+        for dx, dy in corners
+    )
+    bounds = tuple(min(x) for x in zip(*corners)) + tuple(max(x) for x in zip(*corners))
+    extents = tuple(bounds[N_DIMENSIONS + dimension] - bounds[dimension] for dimension in range(N_DIMENSIONS))
+    offsets = (x - center[0], y - center[1])
+    # A pad faces away from the body along its larger offset; its long axis only breaks a tie.
+    if abs(offsets[0]) != abs(offsets[1]):
+        dimension = int(abs(offsets[1]) > abs(offsets[0]))
+    else:
+        dimension = int(extents[1] > extents[0])
+    sign = -1 if offsets[dimension] < 0 else +1
+    direction = Direction(tuple(sign * (other_dimension == dimension) for other_dimension in range(N_DIMENSIONS)))
+    if angle % 90 == 0:
+        return Pad(bounds, direction)
+    return Pad.from_polygon(Polygon(corners), direction)
+
+
+def read_footprint(footprint, outline_layer="F.Fab", copper_layers=("F.Cu", "*.Cu")):
+    points = chain_lines(get_outline_lines(footprint, outline_layer))
+    if get_area(points) < 0:
+        points.reverse()
+    directions = deque(get_line_direction(line) for _, line in linewise(points))
+    center = tuple(sum(x) / len(points) for x in zip(*points))
+    pads = tuple(
+        read_pad(pad, center)
+        for pad in children(footprint, "pad")
+        if child(pad, "size") is not None and any(layer in copper_layers for layer in child(pad, "layers")[1:])
+    )
+    return deque(points), directions, pads
+
+
+def process_footprint(
+    input_path,
+    output_path,
+    outline_layer="F.Fab",
+    layer="F.SilkS",
+    width=0.12,
+    clearance=0,
+    max_passes=None,
+    timeout=None,
+):
+    # Returns `None` if the expansion converged, or else why `expand_bounded` stopped within `max_passes` and
+    # `timeout`, in which case the silkscreen follows the last valid outline.
+    with open(input_path, newline="") as file:
+        footprint, close_offset = parse(tokenize(file))
+    if footprint[0] not in ("footprint", "module"):
+        raise ValueError(f"not a footprint: {footprint[0]}")
+    points, directions, pads = read_footprint(footprint, outline_layer=outline_layer)
+    pad_index = PadIndex(pads, clearance=to_nm(clearance))
+    result = expand_bounded(points, directions, pads, max_passes=max_passes, timeout=timeout, pad_index=pad_index)
+    lines = cut_arrays(result.points, pads, pad_index=pad_index)
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(input_path, newline="") as input_file, open(output_path, "w", newline="") as output_file:
+        n_remaining = close_offset
+        while n_remaining > 0:
+            chunk = input_file.read(min(n_remaining, 1 << 16))
+            if len(chunk) == 0:
+                break
+            output_file.write(chunk)
+            n_remaining -= len(chunk)
+        write_fp_lines(
+            output_file, lines, legacy=footprint[0] == "module", layer=layer, width=width, units_per_mm=NM_PER_MM
+        )
+        output_file.write(input_file.read())
+    return result.reason
+
+
+def walk_footprints(input_path, output_path):
+    if os.path.isfile(input_path):
+        yield input_path, output_path
+        return
+    for directory_path, directory_names, file_names in os.walk(input_path):
+        directory_names.sort()
+        for file_name in sorted(file_names):
+            if file_name.endswith(".kicad_mod"):
+                path = os.path.join(directory_path, file_name)
+                yield path, os.path.join(output_path, os.path.relpath(path, input_path))
+
+
+def process_library(input_path, output_path, **kwargs):
+    # Yields `(input_path, error, reason)` for each footprint, where `error` is `None` on success, and `reason` is
+    # what `process_footprint` returned, or `None` on failure.
+    for footprint_input_path, footprint_output_path in walk_footprints(input_path, output_path):
+        try:
+            reason = process_footprint(footprint_input_path, footprint_output_path, **kwargs)
+        except Exception as e:
+            yield footprint_input_path, e, None
+        else:
+            yield footprint_input_path, None, reason
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--outline-layer", type=str, default="F.Fab")
+    parser.add_argument("--layer", type=str, default="F.SilkS")
+    parser.add_argument("--width", type=float, default=0.12)
+    parser.add_argument("--clearance", type=float, default=0)
+    parser.add_argument("--max-passes", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=None)
+    parser.add_argument("input")
+    parser.add_argument("output")
+    args = parser.parse_args()
+
+    n_footprints = 0
+    n_failures = 0
+    n_unconverged = 0
+    for path, error, reason in process_library(
+        args.input,
+        args.output,
+        outline_layer=args.outline_layer,
+        layer=args.layer,
+        width=args.width,
+        clearance=args.clearance,
+        max_passes=args.max_passes,
+        timeout=args.timeout,
+    ):
+        n_footprints += 1
+        if error is not None:
+            n_failures += 1
+            print(f"{path}: {type(error).__name__}: {error}", file=sys.stderr)
+        elif reason is not None:
+            n_unconverged += 1
+            print(f"{path}: did not converge: {reason}", file=sys.stderr)
+    print(
+        f"{n_footprints - n_failures} of {n_footprints} footprint(s) processed, {n_unconverged} unconverged",
+        file=sys.stderr,
+    )
+    if n_failures > 0:
+        sys.exit(1)
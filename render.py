@@ -0,0 +1,155 @@
+# Copyright (C) 2022 Matthew Marting
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from argparse import ArgumentParser
+from math import ceil, sqrt
+import os
+import sys
+
+from matplotlib.figure import Figure
+
+from batch import read_job, run_batch
+from kicad import parse, read_footprint, to_nm, tokenize, walk_footprints
+from ufg import Trace, draw, replay
+
+
+def contact_sheet(cases, n_columns=None, cell_size=3.0):
+    # Draws each `(title, points, directions, pads, silkscreen_lines)` case in a grid of axes.  The figure is not
+    # attached to pyplot, so it can be saved without a display.
+    cases = tuple(cases)
+    if n_columns is None:
+        n_columns = max(ceil(sqrt(len(cases))), 1)
+    n_rows = max(ceil(len(cases) / n_columns), 1)
+    fig = Figure(figsize=(n_columns * cell_size, n_rows * cell_size))
+    axes = fig.subplots(n_rows, n_columns, squeeze=False).flatten()
+    for ax in axes:
+        ax.set_axis_off()
+    for ax, (title, points, directions, pads, silkscreen_lines) in zip(axes, cases):
+        draw(ax, points, directions, pads, silkscreen_lines)
+        ax.set_title(title, fontsize="small")
+    return fig
+
+
+def write_contact_sheets(cases, path, n_cases_per_sheet=None, dpi=100, **kwargs):
+    # Saves the cases to `path`, or, with `n_cases_per_sheet`, to numbered sheets next to it.  The format follows
+    # the extension, e.g. ".png" or ".svg".  Yields the paths written.
+    cases = iter(cases)
+    root, extension = os.path.splitext(path)
+    sheet_index = 0
+    while True:
+        sheet_cases = []
+        for case in cases:
+            sheet_cases.append(case)
+            if len(sheet_cases) == n_cases_per_sheet:
+                break
+        if len(sheet_cases) == 0 and sheet_index > 0:
+            return
+        if n_cases_per_sheet is None:
+            sheet_path = path
+        else:
+            sheet_path = f"{root}-{sheet_index + 1:04}{extension}"
+        contact_sheet(sheet_cases, **kwargs).savefig(sheet_path, dpi=dpi)
+        yield sheet_path
+        if n_cases_per_sheet is None:
+            return
+        sheet_index += 1
+
+
+def is_footprint_path(path):
+    return os.path.isdir(path) or path.endswith(".kicad_mod")
+
+
+def read_jobs(input_path, outline_layer="F.Fab"):
+    # Yields `(title, job)` for a file of JSON-lines jobs, as read by batch.py, or for a KiCad footprint or library.
+    if is_footprint_path(input_path):
+        for path, _ in walk_footprints(input_path, input_path):
+            try:
+                with open(path, newline="") as file:
+                    footprint, _ = parse(tokenize(file))
+                job = read_footprint(footprint, outline_layer=outline_layer)
+            except Exception as e:
+                print(f"{path}: {type(e).__name__}: {e}", file=sys.stderr)
+                continue
+            yield os.path.splitext(os.path.relpath(path, input_path))[0], job
+        return
+    with open(input_path) as file:
+        for line_index, line in enumerate(file):
+            if line.strip():
+                yield f"{line_index}", read_job(line)
+
+
+def trace_cases(trace):
+    # Yields a case for each step of a trace, converting the steps as they are drawn.
+    for step_index in range(len(trace)):
+        points, directions, rule = trace[step_index]
+        yield f"step {step_index}: {rule}", points, directions, trace.pads, ()
+
+
+def render_cases(titled_jobs, **kwargs):
+    # Yields a case for each `(title, job)` with the job's silkscreen from `run_batch`, or with none if it failed.
+    titled_jobs = tuple(titled_jobs)
+    results = run_batch((job for _, job in titled_jobs), **kwargs)
+    for (title, (points, directions, pads)), (_, status, *optional) in zip(titled_jobs, results):
+        if not status:
+            yield f"{title} (error)", points, directions, pads, ()
+            continue
+        _, silkscreen_lines, reason = optional
+        if reason is not None:
+            title = f"{title} ({reason})"
+        yield title, points, directions, pads, silkscreen_lines
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(allow_abbrev=False)
+    parser.add_argument("-j", "--jobs", type=int, default=None)
+    parser.add_argument("--chunksize", type=int, default=1)
+    parser.add_argument("--cache", type=str, default=None)
+    parser.add_argument("--clearance", type=float, default=0)
+    parser.add_argument("--max-passes", type=int, default=2000)
+    parser.add_argument("--timeout", type=float, default=None)
+    parser.add_argument("--outline-layer", type=str, default="F.Fab")
+    parser.add_argument("--columns", type=int, default=None)
+    parser.add_argument("--cell-size", type=float, default=3.0)
+    parser.add_argument("--dpi", type=float, default=100)
+    parser.add_argument("--per-sheet", type=int, default=None)
+    parser.add_argument("--interval", type=float, default=200)
+    parser.add_argument("input")
+    parser.add_argument("output")
+    args = parser.parse_args()
+
+    # A `.npz` trace is animated into a ".gif" or ".html" file, or drawn step by step into contact sheets.
+    if args.input.endswith(".npz"):
+        trace = Trace.load(args.input)
+        if os.path.splitext(args.output)[1] in (".gif", ".html"):
+            replay(trace, args.output, interval=args.interval)
+        else:
+            for path in write_contact_sheets(
+                trace_cases(trace),
+                args.output,
+                n_cases_per_sheet=args.per_sheet,
+                dpi=args.dpi,
+                n_columns=args.columns,
+                cell_size=args.cell_size,
+            ):
+                print(path, file=sys.stderr)
+        sys.exit()
+
+    # The clearance is in millimetres for footprints, which are read in nanometres, and in the units of jobs else.
+    clearance = to_nm(args.clearance) if is_footprint_path(args.input) else args.clearance
+    for path in write_contact_sheets(
+        render_cases(
+            read_jobs(args.input, outline_layer=args.outline_layer),
+            max_workers=args.jobs,
+            chunksize=args.chunksize,
+            cache_path=args.cache,
+            clearance=clearance,
+            max_passes=args.max_passes,
+            timeout=args.timeout,
+        ),
+        args.output,
+        n_cases_per_sheet=args.per_sheet,
+        dpi=args.dpi,
+        n_columns=args.columns,
+        cell_size=args.cell_size,
+    ):
+        print(path, file=sys.stderr)
@@ -6,9 +6,8 @@ from ufg import *
 
 points = deque(((-4, -2), (+4, -2), (+4, +2), (-4, +2)))
 directions = deque((None, Direction.NORTH, None, Direction.SOUTH))
-pads = (Polygon(((-5, -3), (-3, -3), (-3, +3), (-5, +3))), Polygon(((+3, -3), (+5, -3), (+5, +3), (+3, +3))))
-pads[0].direction = Direction.WEST
-pads[1].direction = Direction.EAST
+pads = (Pad((-5, -3, -3, +3), Direction.WEST), Pad((+3, -3, +5, +3), Direction.EAST))
 
 
-plot(points, directions, pads)
+if __name__ == "__main__":
+    plot(points, directions, pads)
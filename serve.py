@@ -0,0 +1,178 @@
+# Copyright (C) 2022 Matthew Marting
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from argparse import ArgumentParser
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+import json
+import logging
+import os
+import signal
+import stat
+import sys
+import traceback
+
+from batch import _pack_job, _run_job, parse_job, result_record
+from ufg import Direction, Pad
+
+logger = logging.getLogger(__name__)
+
+WARM_UP_JOB = (((0, 0), (4, 0), (4, 4), (0, 4)), (None, None, None, None), (Pad((3, 1, 5, 3), Direction.EAST),))
+
+
+def _warm_up():
+    # Runs a small job, so that the first real job in this worker does not pay for any lazy initialization.
+    _run_job(WARM_UP_JOB)
+    return os.getpid()
+
+
+class _StdinReader:
+    # Reads lines in a thread, since stdin may be a regular file, which the event loop cannot watch.
+    async def readline(self):
+        return await asyncio.get_running_loop().run_in_executor(None, sys.stdin.buffer.readline)
+
+
+class _StdoutWriter:
+    def write(self, data):
+        sys.stdout.buffer.write(data)
+        sys.stdout.buffer.flush()
+
+    async def drain(self):
+        pass
+
+
+class Server:
+    # Serves JSON-lines jobs, as read by batch.py, from a pool of worker processes that stay up between jobs.  Each
+    # result is written as soon as it is ready, as a record like those of batch.py, where "index" counts the jobs
+    # of the stream and "id" is copied from the job, if it has one.
+    def __init__(self, max_workers=None, **kwargs):
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        self.max_workers = max_workers
+        self.kwargs = kwargs
+        self.executor = ProcessPoolExecutor(max_workers=max_workers)
+
+    async def warm_up(self):
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(
+            *(loop.run_in_executor(self.executor, _warm_up) for _ in range(self.max_workers))
+        )
+        logger.info(f"{len(set(pids))} worker(s) ready")
+
+    async def run_job(self, packed_job):
+        loop = asyncio.get_running_loop()
+        executor = self.executor
+        try:
+            return await loop.run_in_executor(executor, partial(_run_job, packed_job, **self.kwargs))
+        except BrokenProcessPool:
+            # A worker died, e.g. it was killed for running out of memory, so later jobs get a new pool.
+            if self.executor is executor:
+                logger.warning("worker pool broken, restarting it")
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+                executor.shutdown(wait=False)
+            return (False, traceback.format_exc())
+
+    async def serve_job(self, line, job_index, writer):
+        record = None
+        try:
+            record = json.loads(line)
+            packed_job = _pack_job(parse_job(record))
+        except Exception:
+            result = (False, traceback.format_exc())
+        else:
+            result = await self.run_job(packed_job)
+        response = result_record((job_index,) + result)
+        if isinstance(record, dict) and "id" in record:
+            response["id"] = record["id"]
+        writer.write((json.dumps(response) + "\n").encode())
+        await writer.drain()
+
+    async def serve_stream(self, reader, writer):
+        # At most a few jobs per worker are read ahead, so that a client sending many jobs is held back.
+        semaphore = asyncio.Semaphore(2 * self.max_workers)
+        tasks = set()
+        job_index = 0
+        while True:
+            await semaphore.acquire()
+            line = await reader.readline()
+            if len(line) == 0:
+                break
+            if not line.strip():
+                semaphore.release()
+                continue
+            task = asyncio.ensure_future(self.serve_job(line, job_index, writer))
+            task.add_done_callback(lambda task: semaphore.release())
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            job_index += 1
+        await asyncio.gather(*tasks)
+
+    async def serve_connection(self, reader, writer):
+        try:
+            await self.serve_stream(reader, writer)
+        except ConnectionError as e:
+            logger.info(f"connection lost: {e}")
+        finally:
+            writer.close()
+
+    async def serve_stdio(self):
+        await self.warm_up()
+        await self.serve_stream(_StdinReader(), _StdoutWriter())
+
+    async def serve_unix(self, path):
+        # A stale socket left by an earlier server is replaced, but any other file at `path` is kept.
+        try:
+            mode = os.stat(path).st_mode
+        except FileNotFoundError:
+            pass
+        else:
+            if not stat.S_ISSOCK(mode):
+                raise FileExistsError(f"{path} exists and is not a socket")
+            os.unlink(path)
+        await self.warm_up()
+        server = await asyncio.start_unix_server(self.serve_connection, path)
+        logger.info(f"listening on {path}")
+        stop = asyncio.Event()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            asyncio.get_running_loop().add_signal_handler(signal_number, stop.set)
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            os.unlink(path)
+        logger.info("stopped")
+
+    def shutdown(self):
+        self.executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(allow_abbrev=False)
+    parser.add_argument("-j", "--jobs", type=int, default=None)
+    parser.add_argument("--socket", type=str, default=None)
+    parser.add_argument("--cache", type=str, default=None)
+    parser.add_argument("--clearance", type=float, default=0)
+    parser.add_argument("--max-passes", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    server = Server(
+        max_workers=args.jobs,
+        cache_path=args.cache,
+        clearance=args.clearance,
+        max_passes=args.max_passes,
+        timeout=args.timeout,
+    )
+    try:
+        if args.socket is None:
+            asyncio.run(server.serve_stdio())
+        else:
+            asyncio.run(server.serve_unix(args.socket))
+    except FileExistsError as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        server.shutdown()
@@ -4,9 +4,7 @@
 from argparse import ArgumentParser
 from collections import deque
 
-from shapely.geometry import Polygon
-
-from ufg import Direction
+from ufg import Direction, Pad
 from fuzz import main
 
 """
@@ -60,15 +58,15 @@ for x1, y1, x2, y2 in (
     (15.0, -2.0, 17.0, 2.0),
     (15.0, -3.0, 17.0, 1.0),
 ):
-    pad = Polygon(((x1, y1), (x2, y1), (x2, y2), (x1, y2)))
     if x2 - x1 > y2 - y1:
-        pad.direction = Direction.EAST
+        direction = Direction.EAST
     else:
-        pad.direction = Direction.SOUTH
-    pads.append(pad)
+        direction = Direction.SOUTH
+    pads.append(Pad((x1, y1, x2, y2), direction))
 pads = tuple(pads)
 
-parser = ArgumentParser(allow_abbrev=False)
-parser.add_argument("-v", "--verbose", action="store_true")
-args = parser.parse_args()
-main(points, directions, pads, debug=args.verbose)
+if __name__ == "__main__":
+    parser = ArgumentParser(allow_abbrev=False)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    main(points, directions, pads, debug=args.verbose)
@@ -4,9 +4,7 @@
 from argparse import ArgumentParser
 from collections import deque
 
-from shapely.geometry import Polygon
-
-from ufg import Direction
+from ufg import Direction, Pad
 from fuzz import main
 
 """
@@ -160,12 +158,11 @@ for (x1, y1, x2, y2), direction in (
     ((-1.0, -10.0, 3.0, -8.0), Direction.WEST),
     ((5.0, -17.0, 9.0, -15.0), Direction.WEST),
 ):
-    pad = Polygon(((x1, y1), (x2, y1), (x2, y2), (x1, y2)))
-    pad.direction = direction
-    pads.append(pad)
+    pads.append(Pad((x1, y1, x2, y2), direction))
 pads = tuple(pads)
 
-parser = ArgumentParser(allow_abbrev=False)
-parser.add_argument("-v", "--verbose", action="store_true")
-args = parser.parse_args()
-main(points, directions, pads, debug=args.verbose)
+if __name__ == "__main__":
+    parser = ArgumentParser(allow_abbrev=False)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    main(points, directions, pads, debug=args.verbose)
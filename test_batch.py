@@ -0,0 +1,20 @@
+# Copyright (C) 2022 Matthew Marting
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import json
+
+from batch import read_job, run_batch
+
+SQUARE = {"points": [[0, 0], [4, 0], [4, 4], [0, 4]], "directions": [None, None, None, None], "pads": []}
+
+
+def test_run_batch_bad_jobs():
+    lines = (
+        json.dumps(SQUARE),
+        json.dumps(dict(SQUARE, directions=["UP", None, None, None])),
+        "not json",
+        json.dumps(SQUARE),
+    )
+    results = tuple(run_batch(lines, max_workers=1, chunksize=2, read=read_job))
+    assert tuple(result[:2] for result in results) == ((0, True), (1, False), (2, False), (3, True))
+    assert "KeyError" in results[1][2]
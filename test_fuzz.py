@@ -0,0 +1,83 @@
+# Copyright (C) 2022 Matthew Marting
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from hashlib import sha256
+import json
+import random
+
+import pytest
+
+from fuzz import case_record, generate
+
+# The defaults of bench.py, but for the numbers of points and pads.
+GENERATOR_KWARGS = {
+    "r_mu": 1.5,
+    "r_sigma": 0.5,
+    "theta_kappa": 4.0,
+    "max_attempts": 100,
+    "direction_weight": 0.5,
+    "margin": 3,
+    "pad_dx": 4,
+    "pad_dy": 2,
+}
+
+# The first 16 hexadecimal digits of the SHA-256 of each case's record, as the generator made them before it
+# indexed the placed lines, or `None` where it gave up, by `(n_points, n_pads, seed)`.
+CASE_DIGESTS = {
+    (4, 2, 0): "8376809c104caf5a",
+    (4, 2, 1): "c32473cf742995ff",
+    (4, 2, 2): "3d5d27007dbc076d",
+    (4, 2, 3): "0e9f38258eead93e",
+    (4, 2, 4): "a2bb92e516dbfc82",
+    (4, 2, 5): "a8c4d8eb620c85d3",
+    (4, 2, 6): "2a6019cac054be45",
+    (4, 2, 7): "27ea0b74da2bd693",
+    (4, 2, 8): "524e8d5fbd556b41",
+    (4, 2, 9): "555a301e2aac0fc3",
+    (16, 16, 0): None,
+    (16, 16, 1): "902dc7cda2e50a75",
+    (16, 16, 2): None,
+    (16, 16, 3): "f2b2ff3b55ca17f4",
+    (16, 16, 4): "d08e588e574dc130",
+    (16, 16, 5): "d8ffb03a23404bba",
+    (16, 16, 6): "0f778d04b54e2ef2",
+    (16, 16, 7): "4d4eda813c896392",
+    (16, 16, 8): "1ce2d6ec8ae6a528",
+    (16, 16, 9): "6b0ee63143957af8",
+    (32, 64, 0): None,
+    (32, 64, 1): None,
+    (32, 64, 2): "223df7c5f72d13f6",
+    (32, 64, 3): "4dc9035363af8dc1",
+    (32, 64, 4): "653e6c505b1cf587",
+    (32, 64, 5): "77b5e6c112f67007",
+    (32, 64, 6): "bbe971b46831aa25",
+    (32, 64, 7): None,
+    (32, 64, 8): "ff4f16341fea46ae",
+    (32, 64, 9): "ba95eac4be405e9f",
+}
+
+
+def generate_record(n_points, n_pads, seed):
+    return case_record(*generate(**GENERATOR_KWARGS, n_points=n_points, n_pads=n_pads, rng=random.Random(seed)))
+
+
+def test_generate_case():
+    assert generate_record(4, 2, 0) == {
+        "points": [[0, 0], [-4, 0], [-4, -2], [4, 0]],
+        "directions": ["WEST", None, None, None],
+        "pads": [
+            {"bounds": [5.0, -4.0, 9.0, -2.0], "direction": "WEST"},
+            {"bounds": [3.0, -6.0, 5.0, -2.0], "direction": "SOUTH"},
+        ],
+    }
+
+
+@pytest.mark.parametrize("n_points, n_pads, seed", sorted(CASE_DIGESTS))
+def test_generate_digest(n_points, n_pads, seed):
+    try:
+        record = generate_record(n_points, n_pads, seed)
+    except RuntimeError:
+        digest = None
+    else:
+        digest = sha256(json.dumps(record, separators=(",", ":")).encode()).hexdigest()[:16]
+    assert digest == CASE_DIGESTS[(n_points, n_pads, seed)]
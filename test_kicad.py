@@ -0,0 +1,26 @@
+# Copyright (C) 2022 Matthew Marting
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import io
+
+from kicad import parse, read_footprint, tokenize
+from ufg import Direction
+
+# An 0805 resistor, whose pads are taller than they are wide but lie to the left and right of the body.
+CHIP_FOOTPRINT = """\
+(footprint "R_0805_2012Metric" (layer "F.Cu")
+  (fp_line (start -1 -0.625) (end 1 -0.625) (layer "F.Fab") (width 0.1))
+  (fp_line (start 1 -0.625) (end 1 0.625) (layer "F.Fab") (width 0.1))
+  (fp_line (start 1 0.625) (end -1 0.625) (layer "F.Fab") (width 0.1))
+  (fp_line (start -1 0.625) (end -1 -0.625) (layer "F.Fab") (width 0.1))
+  (pad "1" smd roundrect (at -0.9125 0) (size 1.025 1.4) (layers "F.Cu" "F.Paste" "F.Mask"))
+  (pad "2" smd roundrect (at 0.9125 0) (size 1.025 1.4) (layers "F.Cu" "F.Paste" "F.Mask"))
+)
+"""
+
+
+def test_read_footprint_chip():
+    footprint, _ = parse(tokenize(io.StringIO(CHIP_FOOTPRINT)))
+    points, directions, pads = read_footprint(footprint)
+    assert len(points) == 4
+    assert tuple(pad.direction for pad in pads) == (Direction.WEST, Direction.EAST)
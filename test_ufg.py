@@ -0,0 +1,291 @@
+# Copyright (C) 2022 Matthew Marting
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from collections import deque
+import importlib
+import random
+
+import numpy as np
+import pytest
+
+from shapely.affinity import rotate
+from shapely.geometry import LineString
+from shapely.geometry import MultiLineString
+from shapely.ops import linemerge
+
+from fuzz import generate
+from ufg import (
+    Direction,
+    N_DIMENSIONS,
+    Pad,
+    PadIndex,
+    bounds_intersect,
+    cut_arrays,
+    expand,
+    expand_bounded,
+    find_intersecting_lines,
+    linewise,
+    Trace,
+)
+import ufg
+
+# The outlines that the original `expand`, before any of the optimizations, returns for the sample footprints.
+BASELINE_POINTS = {
+    "resistor": [(-4, -2), (-4, -3), (4, -3), (4, -2), (4, 2), (4, 3), (-4, 3), (-4, 2)],
+    "chip": [
+        (-4, -7),
+        (-3, -7),
+        (3, -7),
+        (4, -7),
+        (7, -4),
+        (7, -3),
+        (7, 3),
+        (7, 4),
+        (4, 7),
+        (3, 7),
+        (-3, 7),
+        (-4, 7),
+        (-7, 4),
+        (-7, 3),
+        (-7, -3),
+        (-7, -4),
+    ],
+    "test3": [(0, 0), (3, 1), (5, 2), (12, 2), (24, 7), (24, 9), (24, 10), (17, 13), (10, 13), (10, 12)],
+    "test4": [
+        (0, 1),
+        (1, -1),
+        (4, -2),
+        (-3, -4),
+        (-5, -3),
+        (-8, -16),
+        (-8, -18),
+        (-6, -18),
+        (-4, -21),
+        (-2, -21),
+        (-2, -19),
+        (-1, -17),
+        (-1, -18),
+        (0, -18),
+        (0, -17),
+        (3, -17),
+        (6, -18),
+        (6, -16),
+        (6, -15),
+        (4, -12),
+        (4, -13),
+        (4, -14),
+        (2, -13),
+        (19, 0),
+        (19, 1),
+    ],
+}
+
+# The silkscreen lines that the original `cut` returns for `BASELINE_POINTS`, sorted.
+BASELINE_LINES = {
+    "resistor": [
+        [(-4.0, -3.0), (4.0, -3.0)],
+        [(4.0, 3.0), (-4.0, 3.0)],
+    ],
+    "chip": [
+        [(-7.0, -4.0), (-4.0, -7.0)],
+        [(-7.0, -1.0), (-7.0, -2.0)],
+        [(-7.0, 2.0), (-7.0, 1.0)],
+        [(-4.0, 7.0), (-7.0, 4.0)],
+        [(-2.0, -7.0), (-1.0, -7.0)],
+        [(-1.0, 7.0), (-2.0, 7.0)],
+        [(1.0, -7.0), (2.0, -7.0)],
+        [(2.0, 7.0), (1.0, 7.0)],
+        [(4.0, -7.0), (7.0, -4.0)],
+        [(7.0, -2.0), (7.0, -1.0)],
+        [(7.0, 1.0), (7.0, 2.0)],
+        [(7.0, 4.0), (4.0, 7.0)],
+    ],
+    "test3": [
+        [(4.166666666666667, 5.0), (0.0, 0.0), (3.0, 1.0), (5.0, 2.0), (10.0, 2.0)],
+        [
+            (12.0, 2.0),
+            (24.0, 7.0),
+            (24.0, 9.0),
+            (24.0, 10.0),
+            (17.0, 13.0),
+            (10.0, 13.0),
+            (10.0, 12.0),
+            (5.833333333333333, 7.0),
+        ],
+    ],
+    "test4": [
+        [
+            (6.0, -15.0),
+            (4.0, -12.0),
+            (4.0, -13.0),
+            (4.0, -14.0),
+            (2.0, -13.0),
+            (19.0, 0.0),
+            (19.0, 1.0),
+            (9.0, 1.0),
+        ],
+        [
+            (7.0, 1.0),
+            (0.0, 1.0),
+            (1.0, -1.0),
+            (4.0, -2.0),
+            (-3.0, -4.0),
+            (-5.0, -3.0),
+            (-8.0, -16.0),
+            (-8.0, -18.0),
+            (-6.0, -18.0),
+            (-4.0, -21.0),
+            (-2.0, -21.0),
+            (-2.0, -19.0),
+            (-1.0, -17.0),
+            (-1.0, -18.0),
+            (0.0, -18.0),
+            (0.0, -17.0),
+            (3.0, -17.0),
+            (6.0, -18.0),
+            (6.0, -17.0),
+        ],
+    ],
+}
+
+# The defaults of bench.py.
+GENERATOR_KWARGS = {
+    "n_points": 16,
+    "r_mu": 1.5,
+    "r_sigma": 0.5,
+    "theta_kappa": 4.0,
+    "max_attempts": 100,
+    "direction_weight": 0.5,
+    "n_pads": 16,
+    "margin": 3,
+    "pad_dx": 4,
+    "pad_dy": 2,
+}
+
+
+def load_fixture(name):
+    fixture = importlib.import_module(name)
+    return deque(fixture.points), deque(fixture.directions), fixture.pads
+
+
+@pytest.mark.parametrize("name", sorted(BASELINE_POINTS))
+def test_expand_fixture(name):
+    points, directions, pads = load_fixture(name)
+    assert list(expand(points, directions, pads)) == BASELINE_POINTS[name]
+
+
+@pytest.mark.parametrize("name", sorted(BASELINE_LINES))
+def test_cut_fixture(name):
+    _, _, pads = load_fixture(name)
+    lines = cut_arrays(BASELINE_POINTS[name], pads)
+    assert sorted(list(map(tuple, line.tolist())) for line in lines) == BASELINE_LINES[name]
+
+
+def test_expand_debug():
+    plt = pytest.importorskip("matplotlib.pyplot")
+    points, directions, pads = load_fixture("resistor")
+    n_figures = len(plt.get_fignums())
+    with pytest.warns(DeprecationWarning):
+        assert list(expand(points, directions, pads, debug=True)) == BASELINE_POINTS["resistor"]
+    # One figure for the initial outline and one for each expansion.
+    assert len(plt.get_fignums()) - n_figures == 3
+    plt.close("all")
+
+
+def test_expand_debug_and_trace():
+    points, directions, pads = load_fixture("resistor")
+    with pytest.raises(ValueError):
+        expand(points, directions, pads, debug=True, trace=Trace(pads))
+
+
+def reverse(points, directions):
+    # The same outline, clockwise: the line leaving each point is the reverse of the line that entered it.
+    points = deque(points)
+    points.reverse()
+    points.rotate()
+    directions = deque(
+        None if direction is None else Direction(tuple(-x for x in direction.value))
+        for direction in reversed(directions)
+    )
+    return points, directions
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_expand_bounded_clockwise(seed):
+    try:
+        points, directions, pads = generate(**GENERATOR_KWARGS, rng=random.Random(seed))
+    except RuntimeError:
+        pytest.skip("the generator gave up")
+    result = expand_bounded(deque(points), deque(directions), pads, max_passes=2000)
+    clockwise_result = expand_bounded(*reverse(points, directions), pads, max_passes=2000)
+    assert list(clockwise_result.points) == list(result.points)
+    assert list(clockwise_result.directions) == list(result.directions)
+    assert clockwise_result.reason == result.reason
+
+
+@pytest.mark.parametrize("name", sorted(BASELINE_POINTS))
+def test_expand_bounded_hash_collisions(name, monkeypatch):
+    # With every outline hashing alike, each one is compared in full with its replayed predecessors, none of which
+    # match, so the result is unchanged.
+    monkeypatch.setattr(ufg, "_ring_hash", lambda ring: 0)
+    points, directions, pads = load_fixture(name)
+    result = expand_bounded(points, directions, pads)
+    assert result.converged
+    assert list(result.points) == BASELINE_POINTS[name]
+
+
+def reference_cut(points, pads):
+    # The original `cut`: each line of the outline loses what it shares with the pads whose interiors it crosses.
+    line_strings = []
+    for _, line in linewise(points):
+        line_string = LineString(line)
+        for pad in pads:
+            polygon = pad.to_polygon()
+            if line_string.intersects(polygon) and not line_string.touches(polygon):
+                line_string = line_string.difference(polygon)
+        line_strings.extend(getattr(line_string, "geoms", (line_string,)))
+    return linemerge(tuple(line_string for line_string in line_strings if not line_string.is_empty))
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_cut_arrays_reference(seed):
+    try:
+        points, _, pads = generate(**GENERATOR_KWARGS, rng=random.Random(seed))
+    except RuntimeError:
+        pytest.skip("the generator gave up")
+    # Odd seeds exercise the polygon path with rotated pads.
+    if seed % 2 == 1:
+        pads = tuple(Pad.from_polygon(rotate(pad.to_polygon(), 30), pad.direction) for pad in pads)
+    lines = MultiLineString(cut_arrays(points, pads))
+    expected_lines = reference_cut(points, pads)
+    # The pieces agree up to floating-point rounding of the crossing points.
+    assert len(lines.geoms) == len(getattr(expected_lines, "geoms", (expected_lines,)))
+    assert lines.length == pytest.approx(expected_lines.length, abs=1e-9)
+    assert lines.hausdorff_distance(expected_lines) < 1e-9
+
+
+@pytest.mark.parametrize("dtype", (int, float))
+def test_find_intersecting_lines_numpy_scalars(dtype):
+    # A bowtie, whose second and fourth lines cross, with coordinates from a NumPy array, as fuzz.py makes them.
+    points = [(0, 0), (4, 0), (0, 4), (4, 4)]
+    numpy_points = [tuple(point) for point in np.array(points, dtype=dtype)]
+    assert find_intersecting_lines(numpy_points) == find_intersecting_lines(points) == [(1, 3), (3, 1)]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_query_pairs(seed):
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(-100, 100, (int(rng.integers(0, 40)), N_DIMENSIONS))
+    sizes = rng.uniform(0, 30, centers.shape)
+    pads = tuple(
+        Pad(tuple(center - size) + tuple(center + size), Direction.EAST) for center, size in zip(centers, sizes)
+    )
+    pad_index = PadIndex(pads)
+    all_bounds = np.sort(rng.uniform(-150, 150, (int(rng.integers(0, 40)), 2, N_DIMENSIONS)), axis=1).reshape(-1, 4)
+    expected_pairs = [
+        (row_index, pad_number)
+        for row_index, bounds in enumerate(all_bounds.tolist())
+        for pad_number, pad in enumerate(pads)
+        if bounds_intersect(bounds, pad.bounds)
+    ]
+    assert list(zip(*(indices.tolist() for indices in pad_index.query_pairs(all_bounds)))) == expected_pairs
@@ -2,20 +2,31 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 from collections import deque
+from collections import defaultdict
 from enum import Enum
+from heapq import heappop, heappush
+from itertools import chain
 import logging
+from math import isqrt
+from operator import itemgetter
+import os
+from time import perf_counter
+import warnings
 
 import numpy as np
 
+try:
+    from shapely import intersects, linestrings, prepare, touches
+except ImportError:
+    linestrings = None
 from shapely.geometry import LineString
 from shapely.geometry import MultiLineString
 from shapely.geometry import Polygon
-from shapely.ops import linemerge
+from shapely.geometry import box
+from shapely.ops import unary_union
+from shapely.prepared import prep
 
-import matplotlib.pyplot as plt
 
-
-logging.basicConfig()
 logger = logging.getLogger(__name__)
 
 
@@ -26,20 +37,11 @@ def linewise(points):
         yield point1_index, (point1, points[point2_index])
 
 
-def linewise3(points, start_point_index, stop_point_index, step):
-    point_metaindex_stop = (stop_point_index - start_point_index) // step % len(points)
-    if point_metaindex_stop == 0:
-        point_metaindex_stop = len(points)
-    for point_metaindex in range((stop_point_index - start_point_index) // step % len(points)):
-        point1_index = start_point_index + step * point_metaindex
-        point2_index = point1_index + 1
-        point1_index %= len(points)
-        point2_index %= len(points)
-        yield point1_index, ((points[point1_index], points[point2_index]))
-
-
 N_DIMENSIONS = 2
 
+# Bump whenever a change to `expand` or `cut` can change their output, so cached results are not reused.
+ALGORITHM_VERSION = 2
+
 
 class Direction(Enum):
     EAST = (+1, 0)
@@ -55,64 +57,365 @@ class Direction(Enum):
                 return other.value[dimension] == 0
 
 
-def is_proj_zero(l, direction):
+DIRECTIONS = tuple(Direction)
+
+
+def get_dimension(direction):
     for dimension in range(N_DIMENSIONS):
         if direction.value[dimension] != 0:
-            return l[1][dimension] - l[0][dimension] == 0
+            return dimension
+
+
+def line_bounds(line):
+    return tuple(min(x) for x in zip(*line)) + tuple(max(x) for x in zip(*line))
 
 
-def is_proj_negative_to(m, direction, l):
+def bounds_intersect(bounds, other_bounds):
     for dimension in range(N_DIMENSIONS):
-        if direction.value[dimension] != 0:
-            return (m[1][dimension] - m[0][dimension]) / (l[1][dimension] - l[0][dimension]) < 0
-
-
-def find_last_positive_proj_line(points, directions, pad, line_index, line, step):
-    last_positive_proj_line_index = line_index
-    next_last_positive_proj_line_index = line_index
-    _debug_next_last_positive_proj_line = line
-    already_found_perpendicular_line = False
-    logger.debug(
-        #
-        f"searching { {+1: 'counter-clockwise', -1: 'clockwise'}[step] } for "
-        f"last line positive to {line} with respect to {pad.bounds} "
-        f"({pad.direction.name})"
-    )
-    for forward_line_index, forward_line in linewise3(points, line_index + step, line_index, step):
-        if pad.direction.is_perpendicular_to(directions[forward_line_index]):
-            logger.debug(
-                #
-                f"{forward_line} is perpendicular to {pad.bounds} "
-                f"({pad.direction.name})"
+        if bounds[N_DIMENSIONS + dimension] < other_bounds[dimension]:
+            return False
+        if other_bounds[N_DIMENSIONS + dimension] < bounds[dimension]:
+            return False
+    return True
+
+
+class Pad:
+    __slots__ = ("bounds", "direction", "polygon")
+
+    def __init__(self, bounds, direction, polygon=None):
+        self.bounds = tuple(bounds)
+        self.direction = direction
+        self.polygon = polygon
+
+    @classmethod
+    def from_polygon(cls, polygon, direction):
+        if polygon.equals(box(*polygon.bounds)):
+            return cls(polygon.bounds, direction)
+        return cls(polygon.bounds, direction, polygon)
+
+    def __repr__(self):
+        if self.polygon is None:
+            return f"{type(self).__name__}({self.bounds}, {self.direction})"
+        return f"{type(self).__name__}({self.bounds}, {self.direction}, {self.polygon})"
+
+    @property
+    def exterior_coords(self):
+        if self.polygon is not None:
+            return tuple(self.polygon.exterior.coords)
+        x1, y1, x2, y2 = self.bounds
+        return ((x1, y1), (x2, y1), (x2, y2), (x1, y2), (x1, y1))
+
+    def to_polygon(self):
+        if self.polygon is not None:
+            return self.polygon
+        return Polygon(self.exterior_coords)
+
+    def buffer(self, distance):
+        # Mitred corners keep a rectangular pad rectangular.
+        if distance == 0:
+            return self
+        if self.polygon is None:
+            return type(self)(
+                tuple(x - distance for x in self.bounds[:N_DIMENSIONS])
+                + tuple(x + distance for x in self.bounds[N_DIMENSIONS:]),
+                self.direction,
             )
-            already_found_perpendicular_line = True
-            continue
-        if is_proj_zero(forward_line, pad.direction):
-            logger.debug(
-                #
-                f"{forward_line} is zero to {pad.bounds} "
-                f"({pad.direction.name})"
+        return type(self).from_polygon(self.polygon.buffer(distance, join_style=2), self.direction)
+
+
+def as_pad(pad):
+    if isinstance(pad, Pad):
+        return pad
+    return Pad.from_polygon(pad, pad.direction)
+
+
+def coordinate_array(coords):
+    coords = np.array(coords)
+    if coords.dtype.kind not in "iu":
+        coords = coords.astype(float)
+    return coords
+
+
+class PadIndex:
+    def __init__(self, pads, clearance=0):
+        # The pads are grown by `clearance`, so both expansion and cutting keep the silkscreen that far from them.
+        self.clearance = clearance
+        self.pads = tuple(as_pad(pad).buffer(clearance) for pad in pads)
+        self._mask = None
+        self._cell_arrays = None
+        self.pad_bounds = tuple(pad.bounds for pad in self.pads)
+        self.pad_bounds_array = coordinate_array(self.pad_bounds).reshape(-1, 2 * N_DIMENSIONS)
+        self.cells = defaultdict(list)
+        if linestrings is not None:
+            self.pad_array = np.empty(len(self.pads), dtype=object)
+            self.pad_array[:] = tuple(pad.polygon for pad in self.pads)
+            self.rectangle_mask = np.array(tuple(pad.polygon is None for pad in self.pads), dtype=bool)
+            self.pad_dimensions = np.array(tuple(get_dimension(pad.direction) for pad in self.pads), dtype=int)
+        if len(self.pads) == 0:
+            return
+        self.n_cells = max(isqrt(len(self.pads)), 1)
+        self.min = tuple(min(bounds[dimension] for bounds in self.pad_bounds) for dimension in range(N_DIMENSIONS))
+        self.max = tuple(
+            max(bounds[N_DIMENSIONS + dimension] for bounds in self.pad_bounds) for dimension in range(N_DIMENSIONS)
+        )
+        self.cell_size = tuple(
+            (self.max[dimension] - self.min[dimension]) / self.n_cells or 1 for dimension in range(N_DIMENSIONS)
+        )
+        for pad_index, bounds in enumerate(self.pad_bounds):
+            for cell in self._cells(bounds):
+                self.cells[cell].append(pad_index)
+
+    def _cell_range(self, bounds, dimension):
+        start, stop = (
+            min(max(int((x - self.min[dimension]) / self.cell_size[dimension]), 0), self.n_cells - 1)
+            for x in (bounds[dimension], bounds[N_DIMENSIONS + dimension])
+        )
+        return range(start, stop + 1)
+
+    def _cells(self, bounds):
+        for x in self._cell_range(bounds, 0):
+            for y in self._cell_range(bounds, 1):
+                yield x, y
+
+    def _cell_array(self, coords):
+        # The cells of the rows of `coords`, as by `_cell_range`.
+        return np.clip(((coords - self.min) / self.cell_size).astype(int), 0, self.n_cells - 1)
+
+    @property
+    def cell_arrays(self):
+        # The grid as arrays: the pads of the cell numbered `x * n_cells + y` are `cell_pad_indices[start:stop]`,
+        # where `start` and `stop` are `cell_starts[cell]` and `cell_starts[cell + 1]`.
+        if self._cell_arrays is None:
+            cell_numbers = np.array(
+                tuple(x * self.n_cells + y for (x, y), pad_indices in self.cells.items() for _ in pad_indices),
+                dtype=int,
             )
+            order = np.argsort(cell_numbers, kind="stable")
+            cell_pad_indices = np.array(
+                tuple(pad_index for pad_indices in self.cells.values() for pad_index in pad_indices), dtype=int
+            )[order]
+            cell_starts = np.searchsorted(cell_numbers[order], np.arange(self.n_cells**2 + 1))
+            self._cell_arrays = (cell_pad_indices, cell_starts)
+        return self._cell_arrays
+
+    @property
+    def mask(self):
+        # The union of the pads, prepared, which rules out all of them at once for lines that miss it.  On Shapely 2
+        # it is prepared in place, so it also serves the vectorized predicates.
+        if self._mask is None:
+            mask = unary_union(tuple(pad.to_polygon() for pad in self.pads))
+            if linestrings is None:
+                self._mask = prep(mask)
+            else:
+                prepare(mask)
+                self._mask = mask
+        return self._mask
+
+    def query(self, bounds):
+        if len(self.pads) == 0 or not bounds_intersect(bounds, self.min + self.max):
+            return ()
+        pad_indices = set()
+        for cell in self._cells(bounds):
+            pad_indices.update(self.cells.get(cell, ()))
+        return tuple(
+            self.pads[pad_index]
+            for pad_index in sorted(pad_indices)
+            if bounds_intersect(bounds, self.pad_bounds[pad_index])
+        )
+
+    def query_pairs(self, all_bounds):
+        # `query` for each row of `all_bounds` at once, through the same grid.  Returns the row and pad indices of
+        # the pairs whose bounds intersect, ordered by row and then by pad.
+        all_bounds = np.asarray(all_bounds).reshape(-1, 2 * N_DIMENSIONS)
+        if len(self.pads) == 0 or len(all_bounds) == 0:
+            return np.empty(0, dtype=int), np.empty(0, dtype=int)
+        cell_pad_indices, cell_starts = self.cell_arrays
+        min_cells = self._cell_array(all_bounds[:, :N_DIMENSIONS])
+        shapes = self._cell_array(all_bounds[:, N_DIMENSIONS:]) - min_cells + 1
+        n_row_cells = shapes[:, 0] * shapes[:, 1]
+        # An entry for each cell of each row, and then one for each pad of each of those cells.
+        row_indices = np.repeat(np.arange(len(all_bounds)), n_row_cells)
+        cell_metaindices = np.arange(len(row_indices)) - np.repeat(
+            np.cumsum(n_row_cells) - n_row_cells, n_row_cells
+        )
+        cells = (min_cells[row_indices, 0] + cell_metaindices // shapes[row_indices, 1]) * self.n_cells + (
+            min_cells[row_indices, 1] + cell_metaindices % shapes[row_indices, 1]
+        )
+        n_cell_pads = cell_starts[cells + 1] - cell_starts[cells]
+        row_indices = np.repeat(row_indices, n_cell_pads)
+        pad_indices = cell_pad_indices[
+            np.repeat(cell_starts[cells] - np.cumsum(n_cell_pads) + n_cell_pads, n_cell_pads)
+            + np.arange(len(row_indices))
+        ]
+        pad_bounds = self.pad_bounds_array[pad_indices]
+        row_bounds = all_bounds[row_indices]
+        intersect = np.all(row_bounds[:, :N_DIMENSIONS] <= pad_bounds[:, N_DIMENSIONS:], axis=1) & np.all(
+            pad_bounds[:, :N_DIMENSIONS] <= row_bounds[:, N_DIMENSIONS:], axis=1
+        )
+        # A pad in several cells of a row is found once for each.
+        pairs = np.unique(row_indices[intersect] * len(self.pads) + pad_indices[intersect])
+        return pairs // len(self.pads), pairs % len(self.pads)
+
+
+def is_less(t, other_t):
+    return t[0] * other_t[1] < other_t[0] * t[1]
+
+
+def get_crossing_interval(line, bounds):
+    # Clip the line, without its endpoints, to the interior of the rectangle.  Line parameters are kept as
+    # (numerator, denominator) pairs with positive denominators, so they compare exactly.
+    lower = (0, 1)
+    upper = (1, 1)
+    for dimension in range(N_DIMENSIONS):
+        delta = line[1][dimension] - line[0][dimension]
+        low = bounds[dimension] - line[0][dimension]
+        high = bounds[N_DIMENSIONS + dimension] - line[0][dimension]
+        if delta == 0:
+            if not low < 0 < high:
+                return None
             continue
-        if is_proj_negative_to(forward_line, pad.direction, line):
+        if delta < 0:
+            low, high, delta = -high, -low, -delta
+        if is_less(lower, (low, delta)):
+            lower = (low, delta)
+        if is_less((high, delta), upper):
+            upper = (high, delta)
+    if not is_less(lower, upper):
+        return None
+    return (lower, upper)
+
+
+def subtract_interval(intervals, interval):
+    lower, upper = interval
+    new_intervals = []
+    for start, stop in intervals:
+        if is_less(start, lower):
+            new_intervals.append((start, stop if is_less(stop, lower) else lower))
+        if is_less(upper, stop):
+            new_intervals.append((upper if is_less(start, upper) else start, stop))
+    return new_intervals
+
+
+def get_line_point(line, t):
+    numerator, denominator = t
+    if numerator == 0:
+        return line[0]
+    if numerator == denominator:
+        return line[1]
+    return tuple(x1 + (x2 - x1) * numerator / denominator for x1, x2 in zip(*line))
+
+
+def line_crosses_pad(line, line_string, pad):
+    if pad.polygon is None:
+        return get_crossing_interval(line, pad.bounds) is not None
+    return line_string.intersects(pad.polygon) and not line_string.touches(pad.polygon)
+
+
+def is_proj_zero(l, direction):
+    for dimension in range(N_DIMENSIONS):
+        if direction.value[dimension] != 0:
+            return l[1][dimension] - l[0][dimension] == 0
+
+
+class ProjectionScans:
+    # The scans for the last line, walking from a line in either direction, whose projection onto a pad's axis is
+    # positive with respect to the line's, over one ring.  A scan only depends on each line's projection onto
+    # the pad's axis and on the axis of the line's direction, so these are computed once per line, when a scan
+    # first reaches it, and shared by the other scans, and a scan is reused for every pad with the same axis on the
+    # same line.  A scan may walk the whole ring, so the scans are only valid until the ring changes.  With debug
+    # logging, each scan logs every line it visits.
+    __slots__ = ("points", "directions", "line_projections", "last_positive_proj_line_indices", "debug_logging")
+
+    def __init__(self, points, directions):
+        self.points = points
+        self.directions = directions
+        self.line_projections = [None] * len(points)
+        self.last_positive_proj_line_indices = {}
+        self.debug_logging = logger.isEnabledFor(logging.DEBUG)
+
+    def _get_line(self, line_index):
+        return (self.points[line_index], self.points[(line_index + 1) % len(self.points)])
+
+    def find_last_positive_proj_line(self, pad, line_index, step, stats=None):
+        debug_logging = self.debug_logging
+        dimension = get_dimension(pad.direction)
+        key = (line_index, dimension, step)
+        if debug_logging:
+            line = self._get_line(line_index)
             logger.debug(
                 #
-                f"{forward_line} is negative to {line} with respect to {pad.bounds} "
+                f"searching { {+1: 'counter-clockwise', -1: 'clockwise'}[step] } for "
+                f"last line positive to {line} with respect to {pad.bounds} "
                 f"({pad.direction.name})"
             )
-            logger.debug(f"selecting {_debug_next_last_positive_proj_line}")
-            last_positive_proj_line_index = next_last_positive_proj_line_index
+        if key in self.last_positive_proj_line_indices:
+            if stats is not None:
+                stats.n_scans_reused += 1
+            if debug_logging:
+                logger.debug(f"reusing {self._get_line(self.last_positive_proj_line_indices[key])}")
+            return self.last_positive_proj_line_indices[key]
+        if stats is not None:
+            stats.n_scans += 1
+        points, line_projections = self.points, self.line_projections
+        proj = points[(line_index + 1) % len(points)][dimension] - points[line_index][dimension]
+        last_positive_proj_line_index = line_index
+        next_last_positive_proj_line_index = line_index
+        already_found_perpendicular_line = False
+        forward_line_index = line_index
+        for _ in range(len(points) - 1):
+            forward_line_index = (forward_line_index + step) % len(points)
+            line_projection = line_projections[forward_line_index]
+            if line_projection is None:
+                # The axis of the line's direction, or -1 if it has none, followed by its projections onto the axes.
+                direction = self.directions[forward_line_index]
+                point1, point2 = points[forward_line_index], points[(forward_line_index + 1) % len(points)]
+                line_projection = (-1 if direction is None else get_dimension(direction),) + tuple(
+                    x2 - x1 for x1, x2 in zip(point1, point2)
+                )
+                line_projections[forward_line_index] = line_projection
+            if debug_logging:
+                forward_line = self._get_line(forward_line_index)
+            if line_projection[0] >= 0 and line_projection[0] != dimension:
+                if debug_logging:
+                    logger.debug(
+                        #
+                        f"{forward_line} is perpendicular to {pad.bounds} "
+                        f"({pad.direction.name})"
+                    )
+                already_found_perpendicular_line = True
+                continue
+            forward_proj = line_projection[1 + dimension]
+            if forward_proj == 0:
+                if debug_logging:
+                    logger.debug(
+                        #
+                        f"{forward_line} is zero to {pad.bounds} "
+                        f"({pad.direction.name})"
+                    )
+                continue
+            if forward_proj * proj < 0:
+                if debug_logging:
+                    logger.debug(
+                        #
+                        f"{forward_line} is negative to {line} with respect to {pad.bounds} "
+                        f"({pad.direction.name})"
+                    )
+                    logger.debug(f"selecting {self._get_line(next_last_positive_proj_line_index)}")
+                last_positive_proj_line_index = next_last_positive_proj_line_index
+                if already_found_perpendicular_line:
+                    break
+                continue
             if already_found_perpendicular_line:
-                break
-            continue
-        if already_found_perpendicular_line:
-            logger.debug(f"already found perpendicular line, so ignoring {forward_line}")
-            continue
-        logger.debug(f"marking {forward_line}")
-        next_last_positive_proj_line_index = forward_line_index
-        _debug_next_last_positive_proj_line = forward_line
-    logger.debug("done")
-    return last_positive_proj_line_index
+                if debug_logging:
+                    logger.debug(f"already found perpendicular line, so ignoring {forward_line}")
+                continue
+            if debug_logging:
+                logger.debug(f"marking {forward_line}")
+            next_last_positive_proj_line_index = forward_line_index
+        if debug_logging:
+            logger.debug("done")
+        self.last_positive_proj_line_indices[key] = last_positive_proj_line_index
+        return last_positive_proj_line_index
 
 
 def is_line_string_valid(points, line_index, first_positive_proj_line_index, last_positive_proj_line_index):
@@ -125,25 +428,230 @@ def get_expand_direction(line, direction):
     for dimension, expand_direction in zip(range(N_DIMENSIONS), (Direction.SOUTH, Direction.EAST)):
         if direction.value[dimension] != 0:
             proj = line[1][dimension] - line[0][dimension]
-            return Direction(tuple(proj / abs(proj) * x for x in expand_direction.value))
+            return Direction(tuple((int(proj > 0) - int(proj < 0)) * x for x in expand_direction.value))
 
 
-def _expand(points, directions, pads):
-    for line_index, line in linewise(points):
-        for pad in pads:
-            line_string = LineString(line)
-            if not (line_string.intersects(pad) and not line_string.touches(pad)):
-                continue
-            if pad.direction.is_perpendicular_to(directions[line_index]):
-                continue
-            if is_proj_zero(line, pad.direction):
-                continue
-            first_positive_proj_line_index = find_last_positive_proj_line(
-                points, directions, pad, line_index, line, -1
-            )
-            last_positive_proj_line_index = find_last_positive_proj_line(
-                points, directions, pad, line_index, line, +1
+class Ring:
+    # The outline as parallel lists indexed by point, where the direction and cached pads at an index belong to the
+    # line leaving that point.  Lists keep indexing O(1) for the scans, but a splice or range deletion still moves
+    # every later element, so edits are O(n), and `copy` copies all three lists in O(n).
+    __slots__ = ("points", "directions", "line_pads")
+
+    def __init__(self, points, directions, line_pads=None):
+        self.points = list(points)
+        self.directions = list(directions)
+        if line_pads is None:
+            line_pads = (None for _ in self.points)
+        self.line_pads = list(line_pads)
+
+    def __len__(self):
+        return len(self.points)
+
+    def copy(self):
+        ring = Ring.__new__(Ring)
+        ring.points = self.points[:]
+        ring.directions = self.directions[:]
+        ring.line_pads = self.line_pads[:]
+        return ring
+
+    def translate(self, start_index, n_points, dimension, translation):
+        # Translates `n_points` points from `start_index` onward and forgets the pads of the lines between them.
+        for point_metaindex in range(n_points):
+            point_index = (start_index + point_metaindex) % len(self.points)
+            self.points[point_index] = tuple(
+                x + translation if point_dimension == dimension else x
+                for point_dimension, x in enumerate(self.points[point_index])
             )
+            if point_metaindex < n_points - 1:
+                self.line_pads[point_index] = None
+
+    def insert(self, index, point, leading=True):
+        # Inserts `point` before `index`.  The new line leading out of it, or into it if not `leading`, has no
+        # direction, and the other keeps the direction and the cached pads of the line it splits.
+        if leading:
+            direction, line_pads = None, None
+        else:
+            direction, line_pads = self.directions[index - 1], self.line_pads[index - 1]
+            self.directions[index - 1] = None
+            self.line_pads[index - 1] = None
+        self.points[index:index] = (point,)
+        self.directions[index:index] = (direction,)
+        self.line_pads[index:index] = (line_pads,)
+
+    def delete(self, start_index, n_points):
+        # Deletes `n_points` points from `start_index` onward, wrapping around the end.
+        n_wrapped_points = start_index + n_points - len(self.points)
+        for lines in (self.points, self.directions, self.line_pads):
+            if n_wrapped_points <= 0:
+                del lines[start_index:start_index + n_points]
+            else:
+                del lines[start_index:]
+                del lines[:n_wrapped_points]
+
+
+def _query_line_pads(pad_index, line, stats=None):
+    # Returns the pads whose bounds intersect the line's and, if any of them is a polygon, the line as a line
+    # string.
+    # The pad mask is only consulted when there are polygons, since rectangles are clipped exactly and cheaply.
+    query_pads = pad_index.query(line_bounds(line))
+    if all(pad.polygon is None for pad in query_pads):
+        return query_pads, None
+    line_string = LineString(line)
+    if stats is not None:
+        stats.n_predicates += 1
+    if not pad_index.mask.intersects(line_string):
+        return (), line_string
+    return query_pads, line_string
+
+
+def _get_line_pads(line_pads, directions, pad_index, line_index, line, stats=None):
+    # An entry is reused only while its line and direction are unchanged, so translated and inserted lines, which
+    # `_expand` and `_make_valid` reset to `None`, are the only ones tested against the pads again.
+    if line_pads[line_index] is not None:
+        cached_line, cached_direction, pads = line_pads[line_index]
+        if cached_line == line and cached_direction is directions[line_index]:
+            return pads
+    query_pads, line_string = _query_line_pads(pad_index, line, stats=stats)
+    pads = tuple(
+        pad
+        for pad in query_pads
+        if line_crosses_pad(line, line_string, pad)
+        and not pad.direction.is_perpendicular_to(directions[line_index])
+        and not is_proj_zero(line, pad.direction)
+    )
+    if stats is not None:
+        stats.n_predicates += 2 * sum(pad.polygon is not None for pad in query_pads)
+    line_pads[line_index] = (line, directions[line_index], pads)
+    return pads
+
+
+def line_array(points):
+    coords = coordinate_array(points).reshape(-1, N_DIMENSIONS)
+    return np.stack((coords, np.roll(coords, -1, axis=0)), axis=1)
+
+
+def rectangle_crossing_intervals(lines, bounds):
+    # The same clipping as `get_crossing_interval`, for the pairs of lines and rectangles in `lines` and `bounds`.
+    # Returns the numerators and denominators of the lower and upper line parameters, which are only meaningful
+    # where the returned mask is set.
+    starts = lines[:, 0]
+    deltas = lines[:, 1] - starts
+    lows = bounds[:, :N_DIMENSIONS] - starts
+    highs = bounds[:, N_DIMENSIONS:] - starts
+    negative = deltas < 0
+    lows, highs = np.where(negative, -highs, lows), np.where(negative, -lows, highs)
+    deltas = np.abs(deltas)
+    crossed = np.all((deltas != 0) | ((lows < 0) & (0 < highs)), axis=1)
+    lower_numerators = np.zeros_like(deltas[:, 0])
+    lower_denominators = np.ones_like(deltas[:, 0])
+    upper_numerators = np.ones_like(deltas[:, 0])
+    upper_denominators = np.ones_like(deltas[:, 0])
+    for dimension in range(N_DIMENSIONS):
+        moving = deltas[:, dimension] != 0
+        raise_lower = moving & (lows[:, dimension] * lower_denominators > lower_numerators * deltas[:, dimension])
+        lower_numerators = np.where(raise_lower, lows[:, dimension], lower_numerators)
+        lower_denominators = np.where(raise_lower, deltas[:, dimension], lower_denominators)
+        lower_upper = moving & (highs[:, dimension] * upper_denominators < upper_numerators * deltas[:, dimension])
+        upper_numerators = np.where(lower_upper, highs[:, dimension], upper_numerators)
+        upper_denominators = np.where(lower_upper, deltas[:, dimension], upper_denominators)
+    crossed &= lower_numerators * upper_denominators < upper_numerators * lower_denominators
+    return crossed, lower_numerators, lower_denominators, upper_numerators, upper_denominators
+
+
+def crossed_line_pads(lines, pad_index, stats=None):
+    # Returns the line and pad indices of the pairs whose bounds intersect, as found by the pad index, whether each
+    # line crosses its pad, and the crossing intervals of the pairs with rectangular pads, as by
+    # `rectangle_crossing_intervals`.
+    line_indices, pad_indices = pad_index.query_pairs(
+        np.concatenate((lines.min(axis=1), lines.max(axis=1)), axis=1)
+    )
+    pad_bounds = pad_index.pad_bounds_array
+    crossed = np.zeros(len(line_indices), dtype=bool)
+    rectangles = pad_index.rectangle_mask[pad_indices]
+    crossed[rectangles], *rectangle_intervals = rectangle_crossing_intervals(
+        lines[line_indices[rectangles]], pad_bounds[pad_indices[rectangles]]
+    )
+    intervals = tuple(np.zeros(len(line_indices), dtype=x.dtype) for x in rectangle_intervals)
+    for interval, rectangle_interval in zip(intervals, rectangle_intervals):
+        interval[rectangles] = rectangle_interval
+    if not rectangles.all():
+        # Only the lines that meet the pad mask are tested against their polygon pads.
+        polygon_line_indices, polygon_line_metaindices = np.unique(
+            line_indices[~rectangles], return_inverse=True
+        )
+        line_strings = linestrings(lines[polygon_line_indices])
+        masked = intersects(pad_index.mask, line_strings)
+        if stats is not None:
+            stats.n_predicates += len(line_strings)
+        polygon_pairs = np.flatnonzero(~rectangles)[masked[polygon_line_metaindices]]
+        line_strings = line_strings[polygon_line_metaindices[masked[polygon_line_metaindices]]]
+        polygons = pad_index.pad_array[pad_indices[polygon_pairs]]
+        crossed[polygon_pairs] = intersects(line_strings, polygons) & ~touches(line_strings, polygons)
+        if stats is not None:
+            stats.n_predicates += 2 * len(polygons)
+    return line_indices, pad_indices, crossed, intervals
+
+
+def crossed_pad_matrix(lines, pad_index, stats=None):
+    matrix = np.zeros((len(lines), len(pad_index.pads)), dtype=bool)
+    if len(pad_index.pads) == 0:
+        return matrix
+    line_indices, pad_indices, crossed, _ = crossed_line_pads(lines, pad_index, stats=stats)
+    matrix[line_indices[crossed], pad_indices[crossed]] = True
+    return matrix
+
+
+def _update_line_pads(points, directions, line_pads, pad_index, stats=None):
+    dirty_line_indices = np.array(
+        tuple(
+            line_index
+            for line_index, line in linewise(points)
+            if line_pads[line_index] is None
+            or line_pads[line_index][0] != line
+            or line_pads[line_index][1] is not directions[line_index]
+        ),
+        dtype=int,
+    )
+    if len(dirty_line_indices) == 0:
+        return
+    lines = line_array(points)[dirty_line_indices]
+    line_dimensions = np.array(
+        tuple(
+            -1 if directions[line_index] is None else get_dimension(directions[line_index])
+            for line_index in dirty_line_indices
+        ),
+        dtype=int,
+    )
+    pad_dimensions = pad_index.pad_dimensions
+    matrix = crossed_pad_matrix(lines, pad_index, stats=stats)
+    matrix &= (line_dimensions[:, np.newaxis] < 0) | (line_dimensions[:, np.newaxis] == pad_dimensions)
+    matrix &= (lines[:, 1] - lines[:, 0])[:, pad_dimensions] != 0
+    for line_index, row in zip(dirty_line_indices, matrix):
+        line = (points[line_index], points[(line_index + 1) % len(points)])
+        line_pads[line_index] = (
+            line,
+            directions[line_index],
+            tuple(pad_index.pads[pad_position] for pad_position in np.flatnonzero(row)),
+        )
+
+
+def _expand(ring, pad_index, stats=None):
+    debug_logging = logger.isEnabledFor(logging.DEBUG)
+    points, directions, line_pads = ring.points, ring.directions, ring.line_pads
+    if linestrings is not None:
+        _update_line_pads(points, directions, line_pads, pad_index, stats=stats)
+    # The scans are made lazily, since most passes find an expansion after a few lines.
+    scans = None
+    for line_index, line in linewise(points):
+        for pad in _get_line_pads(line_pads, directions, pad_index, line_index, line, stats=stats):
+            if stats is not None:
+                start_time = perf_counter()
+            if scans is None:
+                scans = ProjectionScans(points, directions)
+            first_positive_proj_line_index = scans.find_last_positive_proj_line(pad, line_index, -1, stats=stats)
+            last_positive_proj_line_index = scans.find_last_positive_proj_line(pad, line_index, +1, stats=stats)
+            if stats is not None:
+                stats.times["find_last_positive_proj_line"] += perf_counter() - start_time
             if not is_line_string_valid(
                 points, line_index, first_positive_proj_line_index, last_positive_proj_line_index
             ):
@@ -152,204 +660,729 @@ def _expand(points, directions, pads):
             for dimension in range(N_DIMENSIONS):
                 if expand_direction.value[dimension] != 0:
                     break
+            pad_bound = pad.bounds[N_DIMENSIONS * (expand_direction.value[dimension] > 0) + dimension]
+            if float(pad_bound).is_integer():
+                pad_bound = int(pad_bound)
             translation = (
-                pad.bounds[N_DIMENSIONS * (expand_direction.value[dimension] > 0) + dimension]
-                - line_string.bounds[N_DIMENSIONS * (expand_direction.value[dimension] < 0) + dimension]
-            )
-            logger.debug(
-                f"translating {points[first_positive_proj_line_index]} through "
-                f"{points[(last_positive_proj_line_index + 1) % len(points)]}, inclusive, "
-                f"{translation} {expand_direction.name}"
+                pad_bound - line_bounds(line)[N_DIMENSIONS * (expand_direction.value[dimension] < 0) + dimension]
             )
+            if debug_logging:
+                logger.debug(
+                    f"translating {points[first_positive_proj_line_index]} through "
+                    f"{points[(last_positive_proj_line_index + 1) % len(points)]}, inclusive, "
+                    f"{translation} {expand_direction.name}"
+                )
             if translation < 0:
                 logger.debug(
                     #
                     "note: WEST and SOUTH translations are negative.  "
                     "'-1.0 WEST' means '1.0 to the west'."
                 )
-            new_points = points.copy()
-            new_directions = directions.copy()
-            for point_metaindex in range(
-                ((last_positive_proj_line_index + 2) - first_positive_proj_line_index) % len(new_points)
-            ):
-                point_index = first_positive_proj_line_index + point_metaindex
-                point_index %= len(new_points)
-                new_points[point_index] = tuple(
-                    x + translation if point_dimension == dimension else x
-                    for point_dimension, x in enumerate(new_points[point_index])
-                )
-            insert_point_queue = deque(
-                (
-                    (
-                        first_positive_proj_line_index,
-                        points[first_positive_proj_line_index],
-                        0,
-                    ),
-                    (
-                        last_positive_proj_line_index + 2,
-                        points[(last_positive_proj_line_index + 1) % len(points)],
-                        1,
-                    ),
-                )
-            )
-            while len(insert_point_queue) > 0:
-                index, point, append = insert_point_queue.popleft()
-                index %= len(new_points)
-                if index == 0:
-                    index = len(new_points) * append
-                new_points.insert(index, point)
-                for queue_index, (future_index, future_point, future_append) in enumerate(insert_point_queue):
-                    if future_index < index:
-                        continue
-                    insert_point_queue[queue_index] = (future_index + 1, future_point, future_append)
-            insert_direction_queue = deque(
-                (
-                    first_positive_proj_line_index,
-                    last_positive_proj_line_index + 1,
-                )
+            new_ring = ring.copy()
+            new_ring.translate(
+                first_positive_proj_line_index,
+                ((last_positive_proj_line_index + 2) - first_positive_proj_line_index) % len(points),
+                dimension,
+                translation,
             )
-            while len(insert_direction_queue) > 0:
-                index = insert_direction_queue.popleft()
-                index %= len(new_directions)
-                new_directions.insert(index, None)
-                for queue_index, future_index in enumerate(insert_direction_queue):
-                    if future_index < index:
-                        continue
-                    insert_direction_queue[queue_index] = future_index + 1
-            return (True, new_points, new_directions)
+            index = first_positive_proj_line_index % len(points)
+            new_ring.insert(index, points[first_positive_proj_line_index])
+            other_index = last_positive_proj_line_index + 2
+            if other_index >= index:
+                other_index += 1
+            other_index %= len(new_ring)
+            if other_index == 0:
+                other_index = len(new_ring)
+            new_ring.insert(other_index, points[(last_positive_proj_line_index + 1) % len(points)], leading=False)
+            if stats is not None:
+                stats.n_expansions += 1
+                stats.n_points_added += len(new_ring) - len(points)
+            return (True, new_ring)
     return (False,)
 
 
-def _make_valid(points, directions):
-    for line_index, line in linewise(points):
-        for other_line_index, other_line in linewise3(points, line_index + 2, line_index - 1, +1):
-            if not LineString(line).intersects(LineString(other_line)):
+def orientation(point1, point2, point3):
+    cross = (point2[0] - point1[0]) * (point3[1] - point1[1]) - (point2[1] - point1[1]) * (point3[0] - point1[0])
+    return int(cross > 0) - int(cross < 0)
+
+
+def is_on_line(line, point):
+    for dimension in range(N_DIMENSIONS):
+        if not min(line[0][dimension], line[1][dimension]) <= point[dimension] <= max(
+            line[0][dimension], line[1][dimension]
+        ):
+            return False
+    return True
+
+
+def lines_intersect(line, other_line):
+    orientations = (
+        orientation(*line, other_line[0]),
+        orientation(*line, other_line[1]),
+        orientation(*other_line, line[0]),
+        orientation(*other_line, line[1]),
+    )
+    if orientations[0] != orientations[1] and orientations[2] != orientations[3]:
+        return True
+    return (
+        (orientations[0] == 0 and is_on_line(line, other_line[0]))
+        or (orientations[1] == 0 and is_on_line(line, other_line[1]))
+        or (orientations[2] == 0 and is_on_line(other_line, line[0]))
+        or (orientations[3] == 0 and is_on_line(other_line, line[1]))
+    )
+
+
+def find_intersecting_lines(points):
+    # Sweep the lines in order of their western bounds, keeping the lines whose x-intervals are still open, so each
+    # line is only tested against lines it overlaps in x.  Every intersecting pair of nonadjacent lines is returned
+    # twice, ordered by the first line and then by how many lines the second follows it, counter-clockwise.
+    lines = tuple(line for _, line in linewise(points))
+    all_line_bounds = tuple(line_bounds(line) for line in lines)
+    open_line_indices = set()
+    open_line_heap = []
+    line_index_pairs = []
+    for line_index in sorted(range(len(lines)), key=lambda line_index: all_line_bounds[line_index][0]):
+        bounds = all_line_bounds[line_index]
+        while len(open_line_heap) > 0 and open_line_heap[0][0] < bounds[0]:
+            open_line_indices.remove(heappop(open_line_heap)[1])
+        for other_line_index in open_line_indices:
+            if (other_line_index - line_index + 1) % len(lines) <= 2:
                 continue
-            perpendicular_vector = np.cross(
-                np.concatenate((np.array(line[1]) - np.array(line[0]), (0,))),
-                np.concatenate((np.zeros(N_DIMENSIONS), (1,))),
-            )
-            dot = np.dot(np.array(other_line[1]) - np.array(other_line[0]), perpendicular_vector[:-1])
-            if dot == 0:
+            if not bounds_intersect(bounds, all_line_bounds[other_line_index]):
                 continue
-            if dot > 0:
-                start_index, stop_index = line_index, other_line_index
-            else:
-                start_index, stop_index = other_line_index, line_index
-            new_points = points.copy()
-            new_directions = directions.copy()
-            new_directions[start_index] = None
-            start_index += 1
-            stop_index += 1
-            start_index %= len(new_points)
-            stop_index %= len(new_points)
-            for index in sorted(
-                (
-                    (start_index + metaindex) % len(new_points)
-                    for metaindex in range((stop_index - start_index) % len(new_points))
-                ),
-                reverse=True,
-            ):
-                del new_points[index]
-                del new_directions[index]
-            if len(new_points) < 3:
+            if not lines_intersect(lines[line_index], lines[other_line_index]):
                 continue
-            new_body = Polygon(new_points)
-            if not new_body.is_valid:
-                status, *optional = _make_valid(new_points, new_directions)
-                if not status:
-                    continue
-                new_points, new_directions = optional
-                new_body = Polygon(new_points)
-            if not new_body.covers(Polygon(points)):
+            line_index_pairs.append((line_index, other_line_index))
+            line_index_pairs.append((other_line_index, line_index))
+        open_line_indices.add(line_index)
+        heappush(open_line_heap, (bounds[N_DIMENSIONS], line_index))
+    line_index_pairs.sort(
+        key=lambda line_index_pair: (line_index_pair[0], (line_index_pair[1] - line_index_pair[0]) % len(lines))
+    )
+    return line_index_pairs
+
+
+def _make_valid(ring, stats=None, budget=None):
+    points = ring.points
+    if budget is not None and not budget.spend():
+        return (False,)
+    if stats is not None:
+        stats.n_make_valid_passes += 1
+    for line_index, other_line_index in find_intersecting_lines(points):
+        line = (points[line_index], points[(line_index + 1) % len(points)])
+        other_line = (points[other_line_index], points[(other_line_index + 1) % len(points)])
+        dot = (other_line[1][0] - other_line[0][0]) * (line[1][1] - line[0][1]) - (
+            other_line[1][1] - other_line[0][1]
+        ) * (line[1][0] - line[0][0])
+        if dot == 0:
+            continue
+        if dot > 0:
+            start_index, stop_index = line_index, other_line_index
+        else:
+            start_index, stop_index = other_line_index, line_index
+        new_ring = ring.copy()
+        new_ring.directions[start_index] = None
+        new_ring.line_pads[start_index] = None
+        new_ring.delete((start_index + 1) % len(points), (stop_index - start_index) % len(points))
+        if len(new_ring) < 3:
+            continue
+        new_body = Polygon(new_ring.points)
+        if stats is not None:
+            stats.n_predicates += 1
+        if not new_body.is_valid:
+            status, *optional = _make_valid(new_ring, stats=stats, budget=budget)
+            if not status:
                 continue
-            return (True, new_points, new_directions)
+            (new_ring,) = optional
+            new_body = Polygon(new_ring.points)
+        if stats is not None:
+            stats.n_predicates += 1
+        if not new_body.covers(Polygon(points)):
+            continue
+        if stats is not None:
+            stats.n_points_removed += len(points) - len(new_ring)
+        return (True, new_ring)
     return (False,)
 
 
-def _debug_plot(points, directions, pads):
-    fig, ax = plt.subplots()
-    for pad in pads:
-        x, y = zip(*pad.exterior.coords)
-        plt.plot(x, y, "r")
-    for line_index, line in linewise(points):
-        if directions[line_index] is None:
-            color = "k"
-        else:
-            for dimension, color in zip(range(N_DIMENSIONS), ("y", "c")):
-                if directions[line_index].value[dimension] != 0:
-                    break
-        plt.plot((line[0][0], line[1][0]), (line[0][1], line[1][1]), color)
+def draw(ax, points, directions, pads, silkscreen_lines=(), debug=False):
+    from matplotlib.collections import LineCollection, PolyCollection
+
+    # One collection per kind of geometry, since an artist per line is very slow for large footprints.
+    ax.add_collection(
+        PolyCollection([as_pad(pad).exterior_coords for pad in pads], facecolors="none", edgecolors="r")
+    )
+    if debug:
+        colors = tuple(
+            "k" if direction is None else ("y", "c")[get_dimension(direction)] for direction in directions
+        )
+    else:
+        colors = "g"
+    ax.add_collection(LineCollection(line_array(points), colors=colors))
+    ax.add_collection(LineCollection(silkscreen_lines, colors="k"))
+    ax.autoscale_view()
     ax.set_aspect("equal")
 
 
-def expand(points, directions, pads, debug=False):
-    logger.debug(f"points = {points}")
-    logger.debug(f"directions = {directions}")
-    if debug:
-        _debug_plot(points, directions, pads)
-    if not Polygon(points).exterior.is_ccw:
-        logger.debug("reversing clockwise points")
-        points.reverse().rotate()
-        directions.reverse()
-        directions = deque((Direction(tuple(-np.array(direction.value))) if direction is not None else direction))
+class Stats:
+    def __init__(self):
+        self.n_expansions = 0
+        self.n_make_valid_passes = 0
+        self.n_scans = 0
+        self.n_scans_reused = 0
+        self.n_predicates = 0
+        self.n_points_added = 0
+        self.n_points_removed = 0
+        self.times = defaultdict(float)
+
+    def __repr__(self):
+        return (
+            f"{type(self).__name__}(n_expansions={self.n_expansions}, "
+            f"n_make_valid_passes={self.n_make_valid_passes}, n_scans={self.n_scans}, "
+            f"n_scans_reused={self.n_scans_reused}, "
+            f"n_predicates={self.n_predicates}, n_points_added={self.n_points_added}, "
+            f"n_points_removed={self.n_points_removed}, times={dict(self.times)})"
+        )
+
+
+class Budget:
+    # Bounds `expand_bounded` by the number of passes over the outline, which counts both expansions and
+    # `_make_valid` passes, including the recursive ones, and by the time taken.
+    def __init__(self, max_passes=None, timeout=None):
+        self.max_passes = max_passes
+        self.deadline = None if timeout is None else perf_counter() + timeout
+        self.n_passes = 0
+
+    @property
+    def reason(self):
+        if self.max_passes is not None and self.n_passes >= self.max_passes:
+            return "max_passes"
+        if self.deadline is not None and perf_counter() >= self.deadline:
+            return "timeout"
+        return None
+
+    def spend(self):
+        if self.reason is not None:
+            return False
+        self.n_passes += 1
+        return True
+
+
+class ExpandResult:
+    __slots__ = ("points", "converged", "n_iterations", "n_passes", "reason", "directions")
+
+    def __init__(self, points, converged, n_iterations, n_passes, reason=None, directions=None):
+        self.points = points
+        self.converged = converged
+        self.n_iterations = n_iterations
+        self.n_passes = n_passes
+        self.reason = reason
+        self.directions = directions
+
+    def __repr__(self):
+        return (
+            f"{type(self).__name__}({self.points}, converged={self.converged}, n_iterations={self.n_iterations}, "
+            f"n_passes={self.n_passes}, reason={self.reason!r})"
+        )
+
+
+class Trace:
+    # The outlines `expand_bounded` goes through, each with the rule that produced it, as compact arrays rather than
+    # figures.  A trace is saved to and loaded from a single `.npz` file, and a step is only turned back into points
+    # and directions when it is replayed.
+    RULES = ("initial", "reverse", "expand", "make_valid")
+
+    def __init__(self, pads=()):
+        self.pads = tuple(as_pad(pad) for pad in pads)
+        self.points = []
+        self.directions = []
+        self.rules = []
+
+    def __len__(self):
+        return len(self.rules)
+
+    def record(self, points, directions, rule):
+        self.points.append(coordinate_array(points).reshape(-1, N_DIMENSIONS))
+        self.directions.append(
+            np.array(
+                tuple(-1 if direction is None else DIRECTIONS.index(direction) for direction in directions),
+                dtype=np.int8,
+            )
+        )
+        self.rules.append(self.RULES.index(rule))
+
+    def __getitem__(self, step_index):
+        # Returns the step's points, directions and rule.
+        points = tuple(tuple(point) for point in self.points[step_index].tolist())
+        directions = tuple(None if code < 0 else DIRECTIONS[code] for code in self.directions[step_index].tolist())
+        return points, directions, self.RULES[self.rules[step_index]]
+
+    def save(self, file):
+        pad_coords = tuple(np.array(pad.exterior_coords, dtype=float) for pad in self.pads)
+        np.savez_compressed(
+            file,
+            points=_concatenate(self.points, N_DIMENSIONS),
+            lengths=np.array(tuple(len(points) for points in self.points), dtype=np.int64),
+            directions=_concatenate(self.directions).astype(np.int8),
+            rules=np.array(self.rules, dtype=np.int8),
+            pad_coords=_concatenate(pad_coords, N_DIMENSIONS),
+            pad_lengths=np.array(tuple(len(coords) for coords in pad_coords), dtype=np.int64),
+            pad_directions=np.array(tuple(DIRECTIONS.index(pad.direction) for pad in self.pads), dtype=np.int8),
+        )
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file) as arrays:
+            arrays = dict(arrays)
+        pad_coords = np.split(arrays["pad_coords"], np.cumsum(arrays["pad_lengths"])[:-1])
+        trace = cls(
+            Pad.from_polygon(Polygon(coords), DIRECTIONS[code])
+            for coords, code in zip(pad_coords, arrays["pad_directions"].tolist())
+        )
+        split_indices = np.cumsum(arrays["lengths"])[:-1]
+        trace.points = np.split(arrays["points"], split_indices)[: len(arrays["rules"])]
+        trace.directions = np.split(arrays["directions"], split_indices)[: len(arrays["rules"])]
+        trace.rules = arrays["rules"].tolist()
+        return trace
+
+
+class FigureTrace(Trace):
+    # A trace that also draws each step into a new figure as it is recorded, as `debug=True` used to.
+    def record(self, points, directions, rule):
+        import matplotlib.pyplot as plt
+
+        super().record(points, directions, rule)
+        fig, ax = plt.subplots()
+        draw(ax, points, directions, self.pads, debug=True)
+        ax.set_title(f"step {len(self) - 1}: {rule}")
+
+
+def _debug_trace(pads, debug, trace):
+    # `debug` is a deprecated alias for a `FigureTrace`.
+    if not debug:
+        return trace
+    if trace is not None:
+        raise ValueError("debug and trace cannot both be given")
+    warnings.warn("debug is deprecated, pass trace=FigureTrace(pads) or a Trace instead", DeprecationWarning, 3)
+    return FigureTrace(pads)
+
+
+def _concatenate(arrays, *shape):
+    if len(arrays) == 0:
+        return np.empty((0,) + shape)
+    return np.concatenate(arrays)
+
+
+def _ring_hash(ring):
+    return hash((tuple(ring.points), tuple(ring.directions)))
+
+
+def _replay(ring, pad_index, n_iterations):
+    # Rebuilds the outline that `expand_bounded` reached after `n_iterations` iterations from `ring`.  Every
+    # iteration it reached finished within its budget, so none is needed here.
+    for _ in range(n_iterations):
+        _, ring = _expand(ring, pad_index)
+        while True:
+            status, *optional = _make_valid(ring)
+            if not status:
+                break
+            (ring,) = optional
+    return ring
+
+
+def expand_bounded(
+    points, directions, pads, max_passes=None, timeout=None, debug=False, trace=None, pad_index=None, stats=None
+):
+    # Stops when no expansion applies, when an outline repeats, or when the budget runs out.  Unless it
+    # converged, the result holds the last valid outline, and `reason` is "cycle", "max_passes" or "timeout".
+    # Each intermediate outline is recorded into `trace`, if given.
+    debug_logging = logger.isEnabledFor(logging.DEBUG)
+    if pad_index is None:
+        pad_index = PadIndex(pads)
+    trace = _debug_trace(pad_index.pads, debug, trace)
+    if debug_logging:
         logger.debug(f"points = {points}")
         logger.debug(f"directions = {directions}")
-        if debug:
-            _debug_plot(points, directions, pads)
+    if trace is not None:
+        trace.record(points, directions, "initial")
+    if not Polygon(points).exterior.is_ccw:
+        # The point that ends each line starts it once reversed, so the line leaving each point is the reverse of
+        # the line that entered it: the points are reversed and then rotated, and the directions are reversed and
+        # negated.
+        logger.debug("reversing clockwise points")
+        points = deque(points)
+        points.reverse()
+        points.rotate()
+        directions = deque(
+            None if direction is None else Direction(tuple(-x for x in direction.value))
+            for direction in reversed(directions)
+        )
+        if debug_logging:
+            logger.debug(f"points = {points}")
+            logger.debug(f"directions = {directions}")
+        if trace is not None:
+            trace.record(points, directions, "reverse")
+    budget = Budget(max_passes=max_passes, timeout=timeout)
+    ring = Ring(points, directions)
+    valid_ring = ring
+    # Only a hash of each outline is kept, with the iterations that produced it, and an outline whose hash was seen
+    # is compared in full with the one that `_replay` rebuilds from the start.
+    initial_ring = ring
+    seen_rings = {_ring_hash(ring): [0]}
+    n_iterations = 0
     while True:
-        status, *optional = _expand(points, directions, pads)
+        if not budget.spend():
+            return ExpandResult(
+                deque(valid_ring.points),
+                False,
+                n_iterations,
+                budget.n_passes,
+                budget.reason,
+                directions=deque(valid_ring.directions),
+            )
+        if stats is not None:
+            start_time = perf_counter()
+        status, *optional = _expand(ring, pad_index, stats=stats)
+        if stats is not None:
+            stats.times["expand"] += perf_counter() - start_time
         if not status:
-            break
-        points, directions = optional
-        logger.debug(f"points = {points}")
-        logger.debug(f"directions = {directions}")
-        if debug:
-            _debug_plot(points, directions, pads)
+            return ExpandResult(
+                deque(ring.points), True, n_iterations, budget.n_passes, directions=deque(ring.directions)
+            )
+        (ring,) = optional
+        n_iterations += 1
+        if debug_logging:
+            logger.debug(f"points = {ring.points}")
+            logger.debug(f"directions = {ring.directions}")
+        if trace is not None:
+            trace.record(ring.points, ring.directions, "expand")
         while True:
-            status, *optional = _make_valid(points, directions)
+            if stats is not None:
+                start_time = perf_counter()
+            status, *optional = _make_valid(ring, stats=stats, budget=budget)
+            if stats is not None:
+                stats.times["make_valid"] += perf_counter() - start_time
             if not status:
                 break
-            points, directions = optional
-            logger.debug(f"points = {points}")
-            logger.debug(f"directions = {directions}")
-            if debug:
-                _debug_plot(points, directions, pads)
-    return points
-
-
-def _cut(points, pads):
-    for _, line in linewise(points):
-        lines = LineString(line)
-        for pad in pads:
-            if lines.intersects(pad) and not lines.touches(pad):
-                lines = lines.difference(pad)
-            if lines.is_empty:
-                break
-        else:
-            if hasattr(lines, "geoms"):
-                yield from lines.geoms
-            else:
-                yield lines
+            (ring,) = optional
+            if debug_logging:
+                logger.debug(f"points = {ring.points}")
+                logger.debug(f"directions = {ring.directions}")
+            if trace is not None:
+                trace.record(ring.points, ring.directions, "make_valid")
+        # `_make_valid` gives up when the budget runs out, so the outline may not be valid then.
+        if budget.reason is not None:
+            return ExpandResult(
+                deque(valid_ring.points),
+                False,
+                n_iterations,
+                budget.n_passes,
+                budget.reason,
+                directions=deque(valid_ring.directions),
+            )
+        ring_hash = _ring_hash(ring)
+        seen_iterations = seen_rings.setdefault(ring_hash, [])
+        for seen_n_iterations in seen_iterations:
+            seen_ring = _replay(initial_ring, pad_index, seen_n_iterations)
+            if seen_ring.points == ring.points and seen_ring.directions == ring.directions:
+                return ExpandResult(
+                    deque(ring.points),
+                    False,
+                    n_iterations,
+                    budget.n_passes,
+                    "cycle",
+                    directions=deque(ring.directions),
+                )
+        seen_iterations.append(n_iterations)
+        valid_ring = ring
+
+
+def expand(points, directions, pads, debug=False, trace=None, pad_index=None, stats=None):
+    if pad_index is None:
+        pad_index = PadIndex(pads)
+    trace = _debug_trace(pad_index.pads, debug, trace)
+    result = expand_bounded(points, directions, pads, trace=trace, pad_index=pad_index, stats=stats)
+    if not result.converged:
+        logger.warning(f"expansion stopped after {result.n_iterations} iteration(s): {result.reason}")
+    return result.points
+
+
+def _cut_line(line, line_pads, stats=None):
+    intervals = [((0, 1), (1, 1))]
+    lines = None
+    for pad in line_pads:
+        if lines is None and pad.polygon is None:
+            crossing_interval = get_crossing_interval(line, pad.bounds)
+            if crossing_interval is None:
+                continue
+            intervals = subtract_interval(intervals, crossing_interval)
+            if len(intervals) == 0:
+                return
+            continue
+        if lines is None:
+            lines = MultiLineString(
+                tuple((get_line_point(line, start), get_line_point(line, stop)) for start, stop in intervals)
+            )
+        polygon = pad.to_polygon()
+        if stats is not None:
+            stats.n_predicates += 2
+        if lines.intersects(polygon) and not lines.touches(polygon):
+            lines = lines.difference(polygon)
+        if lines.is_empty:
+            return
+    if lines is None:
+        for start, stop in intervals:
+            yield LineString((get_line_point(line, start), get_line_point(line, stop)))
+    elif hasattr(lines, "geoms"):
+        yield from lines.geoms
+    else:
+        yield lines
+
+
+def get_line_points(lines, numerators, denominators):
+    # `get_line_point` for each line in `lines` and its parameter.
+    numerators = numerators[:, np.newaxis]
+    denominators = denominators[:, np.newaxis]
+    points = lines[:, 0] + (lines[:, 1] - lines[:, 0]) * numerators / denominators
+    points = np.where(numerators == 0, lines[:, 0], points)
+    return np.where(numerators == denominators, lines[:, 1], points)
+
+
+def _uncovered_intervals(line_indices, intervals, n_lines):
+    # Returns the line indices and the parameters of the parts of the lines outside the union of their crossing
+    # intervals, ordered by line and then by parameter.  Lines without crossings are uncovered from 0 to 1.
+    lower_numerators, lower_denominators, upper_numerators, upper_denominators = intervals
+    lowers = lower_numerators / lower_denominators
+    order = np.lexsort((lowers, line_indices))
+    line_indices = line_indices[order]
+    lowers = lowers[order]
+    lower_numerators = lower_numerators[order]
+    lower_denominators = lower_denominators[order]
+    upper_numerators = upper_numerators[order]
+    upper_denominators = upper_denominators[order]
+    # The running maximum of the upper parameters within each line, taken over their ranks so that offsetting each
+    # line's ranks above the previous line's stays exact.
+    uppers, upper_ranks = np.unique(upper_numerators / upper_denominators, return_inverse=True)
+    upper_ranks = upper_ranks.reshape(-1)
+    rank_offsets = line_indices * len(uppers)
+    cover_ranks = np.maximum.accumulate(upper_ranks + rank_offsets) - rank_offsets
+    cover_positions = np.empty(len(uppers), dtype=int)
+    cover_positions[upper_ranks] = np.arange(len(upper_ranks))
+    cover_positions = cover_positions[cover_ranks]
+    covers = uppers[cover_ranks]
+    firsts = np.ones(len(line_indices), dtype=bool)
+    firsts[1:] = line_indices[1:] != line_indices[:-1]
+    lasts = np.ones(len(line_indices), dtype=bool)
+    lasts[:-1] = firsts[1:]
+    # The gaps before each interval, and after the last interval of each line.
+    previous_covers = np.where(firsts, 0, np.roll(covers, 1))
+    previous_cover_positions = np.roll(cover_positions, 1)
+    gaps = previous_covers < lowers
+    lasts &= covers < 1
+    uncovered_lines = np.ones(n_lines, dtype=bool)
+    uncovered_lines[line_indices] = False
+    uncovered_line_indices = np.flatnonzero(uncovered_lines)
+    zeros = np.zeros(len(uncovered_line_indices), dtype=int)
+    ones = np.ones(len(uncovered_line_indices), dtype=int)
+    last_ones = np.ones(np.count_nonzero(lasts), dtype=int)
+    piece_line_indices = np.concatenate((line_indices[gaps], line_indices[lasts], uncovered_line_indices))
+    starts = (
+        np.concatenate(
+            (
+                np.where(firsts, 0, upper_numerators[previous_cover_positions])[gaps],
+                upper_numerators[cover_positions[lasts]],
+                zeros,
+            )
+        ),
+        np.concatenate(
+            (
+                np.where(firsts, 1, upper_denominators[previous_cover_positions])[gaps],
+                upper_denominators[cover_positions[lasts]],
+                ones,
+            )
+        ),
+    )
+    stops = (
+        np.concatenate((lower_numerators[gaps], last_ones, ones)),
+        np.concatenate((lower_denominators[gaps], last_ones, ones)),
+    )
+    order = np.lexsort((starts[0] / starts[1], piece_line_indices))
+    return (
+        piece_line_indices[order],
+        tuple(x[order] for x in starts),
+        tuple(x[order] for x in stops),
+    )
+
+
+def _cut(points, pad_index, stats=None):
+    if linestrings is None:
+        all_line_pads = (_query_line_pads(pad_index, line, stats=stats)[0] for _, line in linewise(points))
+    else:
+        all_line_pads = (
+            tuple(pad_index.pads[pad_position] for pad_position in np.flatnonzero(row))
+            for row in crossed_pad_matrix(line_array(points), pad_index, stats=stats)
+        )
+    for (_, line), line_pads in zip(linewise(points), all_line_pads):
+        yield from _cut_line(line, line_pads, stats=stats)
+
+
+def _cut_arrays(points, pad_index, stats=None):
+    # Returns the pieces of the outline outside the pads, end to end in outline order, and their numbers of points.
+    if linestrings is None:
+        pieces = tuple(np.array(line_string.coords) for line_string in _cut(points, pad_index, stats=stats))
+        if len(pieces) == 0:
+            return np.empty((0, N_DIMENSIONS)), np.empty(0, dtype=int)
+        return np.concatenate(pieces), np.array(tuple(len(piece) for piece in pieces), dtype=int)
+    lines = line_array(points)
+    line_indices, pad_indices, crossed, intervals = crossed_line_pads(lines, pad_index, stats=stats)
+    # Lines crossing a polygon pad are cut by `_cut_line`, and all others are clipped here at once.
+    polygon_lines = np.zeros(len(lines), dtype=bool)
+    polygon_lines[line_indices[crossed & ~pad_index.rectangle_mask[pad_indices]]] = True
+    rectangle_pairs = crossed & ~polygon_lines[line_indices]
+    piece_line_indices, starts, stops = _uncovered_intervals(
+        line_indices[rectangle_pairs], tuple(x[rectangle_pairs] for x in intervals), len(lines)
+    )
+    rectangle_pieces = ~polygon_lines[piece_line_indices]
+    piece_line_indices = piece_line_indices[rectangle_pieces]
+    piece_lines = lines[piece_line_indices]
+    pieces = np.stack(
+        (
+            get_line_points(piece_lines, *(x[rectangle_pieces] for x in starts)),
+            get_line_points(piece_lines, *(x[rectangle_pieces] for x in stops)),
+        ),
+        axis=1,
+    )
+    if not polygon_lines.any():
+        return pieces.reshape(-1, N_DIMENSIONS), np.full(len(pieces), 2, dtype=int)
+    polygon_pieces = []
+    for line_index in np.flatnonzero(polygon_lines):
+        line = (points[line_index], points[(line_index + 1) % len(points)])
+        line_pads = tuple(
+            pad_index.pads[pad_position] for pad_position in pad_indices[crossed & (line_indices == line_index)]
+        )
+        polygon_pieces.extend(
+            (line_index, np.array(line_string.coords)) for line_string in _cut_line(line, line_pads, stats=stats)
+        )
+    all_pieces = sorted(chain(zip(piece_line_indices.tolist(), pieces), polygon_pieces), key=itemgetter(0))
+    if len(all_pieces) == 0:
+        return np.empty((0, N_DIMENSIONS)), np.empty(0, dtype=int)
+    return (
+        np.concatenate(tuple(piece for _, piece in all_pieces)),
+        np.array(tuple(len(piece) for _, piece in all_pieces), dtype=int),
+    )
+
+
+def merge_pieces(coords, lengths):
+    # Joins each piece of a cut outline to the next one where it ends at the next one's start, unless the outline
+    # meets itself there, wrapping around.  A closed outline starts at its least point, as with `linemerge`.
+    # `coords` holds the pieces end to end, in outline order, and `lengths` their numbers of points.
+    if len(lengths) == 0:
+        return ()
+    stops = np.cumsum(lengths)
+    starts = stops - lengths
+    _, endpoint_indices, endpoint_counts = np.unique(
+        np.concatenate((coords[starts], coords[stops - 1])), axis=0, return_inverse=True, return_counts=True
+    )
+    joined = np.all(coords[stops - 1] == coords[np.roll(starts, -1)], axis=1)
+    joined &= endpoint_counts[endpoint_indices.reshape(-1)[len(lengths):]] == 2
+    if joined.all():
+        keep = np.ones(len(coords), dtype=bool)
+        keep[stops - 1] = False
+        coords = coords[keep]
+        x, y = coords.T
+        coords = np.roll(coords, -np.lexsort((y, x))[0], axis=0)
+        return (np.concatenate((coords, coords[:1])),)
+    # Start at a piece that does not continue another.
+    first = (np.flatnonzero(~joined)[-1] + 1) % len(lengths)
+    coords = np.roll(coords, -starts[first], axis=0)
+    lengths = np.roll(lengths, -first)
+    joined = np.roll(joined, -first)
+    stops = np.cumsum(lengths)
+    keep = np.ones(len(coords), dtype=bool)
+    keep[stops[joined] - 1] = False
+    return tuple(np.split(coords[keep], np.cumsum(keep)[stops[~joined] - 1][:-1]))
 
 
-def cut(points, pads):
-    lines = linemerge(_cut(points, pads))
-    if not hasattr(lines, "geoms"):
-        lines = MultiLineString((lines,))
+def cut_arrays(points, pads, pad_index=None, stats=None):
+    # Returns the silkscreen as a tuple of coordinate arrays, one per line string.
+    if pad_index is None:
+        pad_index = PadIndex(pads)
+    if stats is not None:
+        start_time = perf_counter()
+    coords, lengths = _cut_arrays(points, pad_index, stats=stats)
+    if stats is not None:
+        stats.times["cut"] += perf_counter() - start_time
+        start_time = perf_counter()
+    lines = merge_pieces(coords, lengths)
+    if stats is not None:
+        stats.times["merge"] += perf_counter() - start_time
     return lines
 
 
-def plot(points, directions, pads, debug=False):
-    silkscreen = cut(expand(points, directions, pads, debug=debug), pads)
-    fig, ax = plt.subplots()
-    for pad in pads:
-        x, y = zip(*pad.exterior.coords)
-        plt.plot(x, y, "r")
-    for line_index, line in linewise(points):
-        plt.plot((line[0][0], line[1][0]), (line[0][1], line[1][1]), "g")
-    for silkscreen_line_string in silkscreen.geoms:
-        x, y = zip(*silkscreen_line_string.coords)
-        plt.plot(x, y, "k")
-    ax.set_aspect("equal")
-    plt.show()
+def cut(points, pads, pad_index=None, stats=None):
+    return MultiLineString(cut_arrays(points, pads, pad_index=pad_index, stats=stats))
+
+
+def silkscreen(points, directions, pads, pad_index=None, stats=None, clearance=0):
+    if pad_index is None:
+        pad_index = PadIndex(pads, clearance=clearance)
+    return cut(
+        expand(points, directions, pads, pad_index=pad_index, stats=stats), pads, pad_index=pad_index, stats=stats
+    )
+
+
+def replay(trace, file=None, interval=200):
+    # Animates a trace, drawing each step only when its frame comes up.  Without a file, the animation is returned
+    # for `plt.show`, and must be kept referenced until then; with one, it is saved without a display, in the format
+    # of the file's extension, e.g. ".gif".
+    from matplotlib.animation import FuncAnimation
+
+    if file is None:
+        import matplotlib.pyplot as plt
+
+        fig, ax = plt.subplots()
+    else:
+        from matplotlib.figure import Figure
+
+        fig = Figure()
+        ax = fig.subplots()
+
+    def draw_step(step_index):
+        points, directions, rule = trace[step_index]
+        ax.clear()
+        draw(ax, points, directions, trace.pads, debug=True)
+        ax.set_title(f"step {step_index}: {rule}")
+
+    animation = FuncAnimation(fig, draw_step, frames=len(trace), interval=interval, repeat=False)
+    if file is not None:
+        animation.save(file, writer="html" if file.endswith(".html") else None)
+    return animation
+
+
+def plot(points, directions, pads, debug=False, clearance=0, file=None):
+    # Shows the figure, or, given a file, saves it without a display in the format of the file's extension.  With
+    # `debug`, the expansion is traced and replayed alongside, or saved next to the file as a `.npz` trace.
+    pad_index = PadIndex(pads, clearance=clearance)
+    trace = Trace(pad_index.pads) if debug else None
+    silkscreen_lines = cut_arrays(
+        expand(points, directions, pads, trace=trace, pad_index=pad_index), pads, pad_index=pad_index
+    )
+    if file is None:
+        import matplotlib.pyplot as plt
+
+        if debug:
+            # The animation only runs while it is referenced.
+            animation = replay(trace)  # noqa: F841
+        fig, ax = plt.subplots()
+    else:
+        from matplotlib.figure import Figure
+
+        if debug:
+            trace.save(f"{os.path.splitext(file)[0]}.npz")
+        fig = Figure()
+        ax = fig.subplots()
+    draw(ax, points, directions, pads, silkscreen_lines)
+    if file is None:
+        plt.show()
+    else:
+        fig.savefig(file)